@@ -1,13 +1,19 @@
 #!/usr/bin/env python
 
-# check-daily-slack.py -- Check for the daily AliPhysics tag, notify on Slack.
+# check-daily-slack.py -- Check for tags being published, notify on Slack.
 #
-# This script continuously checks for the presence of the AliPhysics daily tag
-# every 300 seconds, on AliEn and CVMFS. If it's past 4pm it checks for today's
-# daily, if it's before, it checks for yesterday's. In case the tag is found on
-# both AliEn and CVMFS, a successful notification is sent and no further
-# notification will occur (until the next daily tag). In case it's not found,
-# a nagging notification is sent every 15 minutes.
+# This script continuously checks every 300 seconds for the presence of tags on
+# AliEn and CVMFS, as defined by a list of rules. Each rule has a package, a tag
+# pattern (strftime format) and the daily build time: if it's past the build
+# time the tag of today is checked, if it's before, the one of yesterday. In
+# case the tag is found on both AliEn and CVMFS, a successful notification is
+# sent and no further notification will occur for this rule (until the next
+# daily tag). In case it's not found after the deadline, a nagging notification
+# is sent every 15 minutes. By default, the AliPhysics vAN-YYYYMMDD daily tag
+# is checked, built at 4pm and expected at 5:30pm.
+#
+# Each source (AliEn packages page, CVMFS listings) is read once per cycle and
+# indexed, whatever the number of rules.
 #
 # Time checks are all explicitly performed using the Geneva time zone, and
 # notifications are sent on a certain Slack channel.
@@ -21,6 +27,9 @@
 # CVMFS_CHECK_POSIX (optional)
 #   Set to 1 to check on mounted /cvmfs or Parrot-provided /cvmfs (by default
 #   tries to use the CVMFS monitor HTTP interface)
+# CHECK_RULES (optional)
+#   JSON file with the list of rules, for instance:
+#     [ { "package": "AliPhysics", "tag": "vAN-%Y%m%d", "build": "16:00", "deadline": "17:30" } ]
 
 from __future__ import print_function
 import json
@@ -30,11 +39,20 @@ import re
 import requests
 import subprocess
 import traceback
+from bisect import bisect_left
 from datetime import datetime, timedelta
+from multiprocessing.pool import ThreadPool
 from subprocess import Popen
 from sys import exit
 from time import sleep
 
+# All HTTP requests share one session (connections are kept alive). Listings are cached by URL
+# with their ETag: an unchanged listing is not parsed twice
+session = requests.Session()
+listings = {}
+
+DEFAULT_RULES = [ { "package": "AliPhysics", "tag": "vAN-%Y%m%d", "build": "16:00", "deadline": "17:30" } ]
+
 def getout(cmd):
   with open(os.devnull) as dn:
     p = Popen(cmd if type(cmd) is list else cmd.split(" "), stdout=subprocess.PIPE, stderr=dn)
@@ -55,7 +73,7 @@ def quench(f):
 @quench
 def print_slack(msg):
   debug(msg)
-  requests.post(os.environ["SLACK_PRIVATE_URL"], data=json.dumps({"text":msg}))
+  session.post(os.environ["SLACK_PRIVATE_URL"], data=json.dumps({"text":msg}))
   return True
 
 def debug(msg):
@@ -63,88 +81,167 @@ def debug(msg):
     return
   print("%s> %s" % (datetime.isoformat(datetime.utcnow()), msg))
 
-def is_on_cvmfs(pkg, tag):
+def cvmfs_index(pkgs):
   if os.environ.get("CVMFS_CHECK_POSIX", "0").lower() in [ "1", "yes", "true", "on" ]:
-    return is_on_cvmfs_posix(pkg, tag)
-  return is_on_cvmfs_http(pkg, tag)
+    return cvmfs_index_posix(pkgs)
+  return cvmfs_index_http(pkgs)
 
 def update_health_check():
   with open("/tmp/check-daily-slack-health", "w") as hc:
     hc.write("healthy")
 
+def get_listing(url, parse, missing=None):
+  # Return parse(lines of url), or missing (if not None) when url does not exist. With an ETag from
+  # a previous call the request is conditional, and the previous result is returned if the
+  # listing did not change
+  etag,result = listings.get(url, (None, None))
+  r = session.get(url, stream=True, timeout=20, headers={ "If-None-Match": etag } if etag else {})
+  try:
+    if r.status_code == 304:
+      return result
+    if r.status_code == 404 and missing is not None:
+      return missing
+    r.raise_for_status()
+    result = parse(r.iter_lines())
+  finally:
+    r.close()
+  if r.headers.get("ETag"):
+    listings[url] = (r.headers["ETag"], result)
+  return result
+
+def make_index(entries):
+  # Sorted list of VO_ALICE@<package>::<version> entries, searched by prefix with bisection
+  return sorted(set(entries))
+
+def index_has(index, pkg, tag):
+  prefix = "VO_ALICE@%s::%s" % (pkg, tag)
+  i = bisect_left(index, prefix)
+  return i < len(index) and index[i].startswith(prefix)
+
 @quench
-def is_on_cvmfs_posix(pkg, tag):
-  # Check if found on CVMFS on at least one architecture
+def cvmfs_index_posix(pkgs):
+  # All versions of pkgs found on CVMFS, on any architecture. The package directories are listed
+  # by a single find, given one argument per architecture and package (never one per version).
+  # Packages found nowhere are not an error, a repository which cannot be read is
   parrot = [ "env",
              "HTTP_PROXY=DIRECT;",
              "PARROT_ALLOW_SWITCHING_CVMFS_REPOSITORIES=yes",
              "PARROT_CVMFS_REPO=<default-repositories>",
              "parrot_run" ]
+  script = "cd /cvmfs/alice.cern.ch && shopt -s nullglob && set -- %s && " \
+           "if [ $# -gt 0 ]; then find \"$@\" -mindepth 1 -maxdepth 1; fi" % \
+           " ".join("*/Modules/modulefiles/%s" % p for p in pkgs)
   for cmdprefix in ([], parrot):
-    for d in getout(cmdprefix + ["ls", "-1", "/cvmfs/alice.cern.ch"])[0].split("\n"):
-      if getout(cmdprefix + ["bash", "-c", "ls -1 /cvmfs/alice.cern.ch/%s/Modules/modulefiles/%s/%s*" % (d, pkg, ver)])[1] == 0:
-        return True
-  return False
+    out,code = getout(cmdprefix + ["bash", "-c", script])
+    entries = [ "VO_ALICE@%s::%s" % (x.split("/")[-2], x.split("/")[-1])
+                for x in out.split("\n") if x.count("/") > 2 ]
+    if entries or code == 0:
+      return make_index(entries)
+  raise Exception("cannot list /cvmfs/alice.cern.ch, also through Parrot")
 
 @quench
-def is_on_cvmfs_http(pkg, tag):
+def cvmfs_index_http(pkgs):
+  # All versions of pkgs found on CVMFS, on any architecture: listings are fetched concurrently
   path_prefix = "/cvmfs-monitor/cb/browser/alice.cern.ch/latest"
   url_prefix = "http://cernvm-monitor.cern.ch/%s" % path_prefix
-  for i in requests.get(url_prefix, stream=True).iter_lines():
-    m = re.search('href="%s/([^"?]+)"' % path_prefix, i)
-    if m:
-      d = m.group(1).strip("/")
-      for j in requests.get("%s/%s/Modules/modulefiles/AliPhysics" % (url_prefix, d), stream=True, timeout=20).iter_lines():
-        if tag in j:
-          return True
-  return False
+  dirs = get_listing(url_prefix,
+                     lambda lines: [ m.group(1).strip("/")
+                                     for m in (re.search('href="%s/([^"?]+)"' % path_prefix, i) for i in lines)
+                                     if m ])
+  def versions(job):
+    # Not all directories have modulefiles for all packages (not found: no entries). Only the root
+    # listing can fail the whole index: a directory which cannot be listed has no entries
+    d,pkg = job
+    url = "%s/%s/Modules/modulefiles/%s" % (url_prefix, d, pkg)
+    try:
+      return get_listing(url,
+                         lambda lines: [ "VO_ALICE@%s::%s" % (pkg, m.group(1))
+                                         for m in (re.search('href="[^"]*/modulefiles/%s/([^"/?]+)' % re.escape(pkg), i) for i in lines)
+                                         if m ],
+                         missing=[])
+    except requests.RequestException as e:
+      print("cannot list %s, skipping it: %s" % (url, e))
+      return []
+  pool = ThreadPool(8)
+  try:
+    return make_index(x for entries in pool.map(versions, [ (d, p) for d in dirs for p in pkgs ]) for x in entries)
+  finally:
+    pool.terminate()
 
 @quench
-def is_on_alien(pkg, tag):
-  # Check if found on AliEn from the alimonitor web page
-  alien_pkg = "VO_ALICE@%s::%s" % (pkg, tag)
-  for line in requests.get("http://alimonitor.cern.ch/packages", stream=True, timeout=20).iter_lines():
-    if alien_pkg in line:
-      return True
-  return False
-
-status_alien = False
-status_cvmfs = False
-last_ver = ""
-last_report_err = 0
+def alien_index():
+  # All packages registered on AliEn, from the alimonitor web page
+  return get_listing("http://alimonitor.cern.ch/packages",
+                     lambda lines: make_index(m.group(0) for line in lines
+                                              for m in re.finditer(r"VO_ALICE@[^:\s\"'<>]+::[^\s\"'<>,]+", line)))
+
+def load_rules():
+  fn = os.environ.get("CHECK_RULES")
+  rules = json.load(open(fn)) if fn else DEFAULT_RULES
+  for r in rules:
+    r.setdefault("build", "16:00")
+    r.setdefault("deadline", r["build"])
+    r["build"] = [ int(x) for x in r["build"].split(":") ]
+    r["deadline"] = [ int(x) for x in r["deadline"].split(":") ]
+  return rules
+
+def rule_tag(rule, now):
+  # Tag to verify and its deadline. Takes correct timezone into account
+  tz = pytz.timezone("Europe/Zurich")
+  tagtime = now - timedelta(days=1 if (now.hour, now.minute) < tuple(rule["build"]) else 0)
+  deadline = tz.localize(datetime(tagtime.year, tagtime.month, tagtime.day, *rule["deadline"]))
+  if rule["deadline"] < rule["build"]:
+    deadline += timedelta(days=1)
+  return tagtime.strftime(rule["tag"]), deadline
+
+try:
+  rules = load_rules()
+except (IOError,ValueError,KeyError,TypeError,AttributeError) as e:
+  print("cannot load rules from %s: %s" % (os.environ.get("CHECK_RULES"), e))
+  exit(1)
+status = [ { "ver": "", "alien": False, "cvmfs": False, "last_report_err": 0 } for _ in rules ]
 while True:
-  # Decide what is the tag to verify. Takes correct timezone into account
   now = datetime.now(pytz.timezone("Europe/Zurich"))
-  tagtime = now - timedelta(days=1 if now.hour < 16 else 0)
-  tagtime = pytz.timezone("Europe/Zurich").localize(datetime(tagtime.year, tagtime.month, tagtime.day, 16))
-  elapsed = (now-tagtime).total_seconds()
-  ver = "vAN-%04d%02d%02d" % (tagtime.year, tagtime.month, tagtime.day)
-  debug("Checking %s" % ver)
-  if ver != last_ver:
-    # New day, new tag
-    status_alien = False
-    status_cvmfs = False
-    last_ver = ver
-    last_report_err = 0
-  if not status_alien or not status_cvmfs:
-    status_alien = is_on_alien("AliPhysics", ver) if not status_alien else True
-    status_cvmfs = is_on_cvmfs("AliPhysics", ver) if not status_cvmfs else True
-    if status_alien and status_cvmfs:
-      if not print_slack(":+1: %s/%s OK: found both on AliEn and CVMFS" % ("AliPhysics", ver)):
-        last_ver = ""  # force resend
-    elif elapsed > 5400 and (last_report_err == 0 or (now-last_report_err).total_seconds() > 900):
-      # Start worrying after 17h30 (+5400 s after 16h). Snooze for 15 minutes (900 s)
+  pending = []
+  for rule,st in zip(rules, status):
+    ver,deadline = rule_tag(rule, now)
+    debug("Checking %s/%s" % (rule["package"], ver))
+    if ver != st["ver"]:
+      # New day, new tag
+      st.update(ver=ver, alien=False, cvmfs=False, last_report_err=0)
+    st["deadline"] = deadline
+    if not st["alien"] or not st["cvmfs"]:
+      pending.append((rule, st))
+    else:
+      debug("%s/%s already verified to be OK" % (rule["package"], ver))
+
+  # Each source is read once for all pending rules
+  if [ st for _,st in pending if not st["alien"] ]:
+    index = alien_index() or []
+    for rule,st in pending:
+      st["alien"] = st["alien"] or index_has(index, rule["package"], st["ver"])
+  pkgs = sorted(set(rule["package"] for rule,st in pending if not st["cvmfs"]))
+  if pkgs:
+    index = cvmfs_index(pkgs) or []
+    for rule,st in pending:
+      st["cvmfs"] = st["cvmfs"] or index_has(index, rule["package"], st["ver"])
+
+  for rule,st in pending:
+    pkg,ver = rule["package"],st["ver"]
+    if st["alien"] and st["cvmfs"]:
+      if not print_slack(":+1: %s/%s OK: found both on AliEn and CVMFS" % (pkg, ver)):
+        st["ver"] = ""  # force resend
+    elif now > st["deadline"] and (st["last_report_err"] == 0 or (now-st["last_report_err"]).total_seconds() > 900):
+      # Start worrying after the deadline. Snooze for 15 minutes (900 s)
       if not print_slack((":poop: %s/%s not OK: "  +
                           "%savailable on AliEn, " +
-                          "%savailable on CVMFS")  % ("AliPhysics", ver,
-                                                      "" if status_alien else "not ",
-                                                      "" if status_cvmfs else "not ")):
-        last_ver = ""  # force resend
-      last_report_err = now - timedelta(days=0)
+                          "%savailable on CVMFS")  % (pkg, ver,
+                                                      "" if st["alien"] else "not ",
+                                                      "" if st["cvmfs"] else "not ")):
+        st["ver"] = ""  # force resend
+      st["last_report_err"] = now
     else:
-      debug("Not OK (AliEn: %s, CVMFS: %s) but within grace time" % (status_alien, status_cvmfs))
-  else:
-    debug("Already verified to be OK")
+      debug("%s/%s not OK (AliEn: %s, CVMFS: %s) but within grace time" % (pkg, ver, st["alien"], st["cvmfs"]))
   for _ in range(5):
     update_health_check()
     sleep(60)
@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 from __future__ import print_function
-from github import Github,GithubException
+from metagit import MetaGit,MetaGitException
 import os, sys, pytz
 from datetime import datetime
 
@@ -13,29 +13,41 @@ def utc_to_local(utc_dt):
 tag_time = utc_to_local(datetime.utcnow())
 tag_time = tag_time.replace(microsecond=0, second=0, **dict(zip(["hour", "minute"], map(int, sys.argv[1].split(":", 1)))))
 
-gh = Github(login_or_token=open(os.path.expanduser("~/.github-token")).read().strip())
+git = MetaGit.init(backend="GitHub", token=open(os.path.expanduser("~/.github-token")).read().strip())
+gh = git.gh
 
 for repo_name in sys.argv[2:]:
   build_test_name = "build/%s/release" % (repo_name.split("/", 1)[1] if "/" in repo_name else repo_name)
   print("Threshold: %s (Geneva), build test name: %s" % (tag_time, build_test_name))
-  for pull in gh.get_repo(repo_name).get_pulls():
+  pulls = list(gh.get_repo(repo_name).get_pulls())
+  # Statuses of all pull requests in a single round trip
+  try:
+    all_statuses = git.get_statuses_many([ "%s#%d" % (repo_name, p.number) for p in pulls ],
+                                         [ build_test_name, "review" ])
+  except MetaGitException as e:
+    print("Cannot get statuses for %s: %s" % (repo_name, e))
+    sys.exit(1)
+  for pull in pulls:
     when = utc_to_local(pull.created_at)
     if when > tag_time:
       print("%s#%d: created at %s (Geneva): not waiting: too late" % (repo_name, pull.number, when))
       continue
     # review must be success / build/AliPhysics/release must not be error
-    review = None
-    build = None
-    what_approved = None
-    for st in pull.base.repo.get_commit(pull.head.sha).get_statuses():
-      if not build and st.context == build_test_name:
-        build = st.state
-      if not review and st.context == "review":
-        review = st.state
-        what_approved = st.description
-        print(what_approved)
-      if review and build:
-        break
+    pr = "%s#%d" % (repo_name, pull.number)
+    if pr in all_statuses:
+      statuses = all_statuses[pr]
+    else:
+      # Not in the batched result: read them alone, and never assume there are none
+      try:
+        statuses = git.get_statuses(pr, [ build_test_name, "review" ])
+      except MetaGitException as e:
+        print("Cannot get statuses for %s: %s" % (pr, e))
+        sys.exit(1)
+    build = statuses[build_test_name].state if build_test_name in statuses else None
+    review = statuses["review"].state if "review" in statuses else None
+    what_approved = statuses["review"].description if "review" in statuses else None
+    if review:
+      print(what_approved)
     if review == "success" and not build == "error" and what_approved == "merge approved":
       print("%s#%d: created at %s (Geneva), review: %s (%s), build: %s: must wait" % (repo_name, pull.number, when, review, what_approved, build))
       sys.exit(1)
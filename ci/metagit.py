@@ -1,9 +1,11 @@
 from github import Github, GithubException
-from collections import namedtuple
-from time import time
+from requests import post, request, RequestException
+from collections import namedtuple, OrderedDict
+from threading import RLock
+from time import time, sleep
 from os import listdir
 from datetime import datetime
-import logging, yaml, os
+import atexit, calendar, json, logging, yaml, os
 
 MetaPull = namedtuple("MetaPull", [ "name", "repo", "num", "title", "changed_files", "sha",
                                     "closed_at", "mergeable", "mergeable_state", "who", "when",
@@ -40,6 +42,91 @@ def apicalls(f):
     return fr
   return fn
 
+class MetaCache(object):
+  # Size and time bounded LRU cache of PyGithub objects. Entries older than ttl are not thrown
+  # away but revalidated with a conditional request (ETag/Last-Modified): when nothing changed
+  # GitHub answers 304, which does not count against the rate limit. Use ttl=None for immutable
+  # objects (e.g. commits by sha), which are never revalidated
+  def __init__(self, name, maxsize, ttl):
+    self.name = name
+    self.maxsize = maxsize
+    self.ttl = ttl
+    self.data = OrderedDict()  # key -> [object, time of last validation]
+    self.lock = RLock()
+    self.hits = 0
+    self.misses = 0
+    self.revalidated = 0
+    self.evicted = 0
+
+  def get(self, key, fetch, maxage=None):
+    # Return the cached object for key, calling fetch() on a miss. If maxage (defaults to ttl)
+    # is exceeded the object is revalidated first
+    maxage = self.ttl if maxage is None else maxage
+    with self.lock:
+      entry = self.data.pop(key, None)
+      if entry is not None:
+        self.data[key] = entry  # most recently used goes last
+    if entry is None:
+      obj = fetch()
+      with self.lock:
+        self.misses += 1
+        self.data[key] = [obj, time()]
+        while len(self.data) > self.maxsize:
+          self.data.popitem(last=False)
+          self.evicted += 1
+      return obj
+    obj,validated = entry
+    if maxage is not None and time()-validated >= maxage and hasattr(obj, "update"):
+      changed = obj.update()  # conditional request
+      entry[1] = time()
+      with self.lock:
+        self.revalidated += 1
+        if changed:
+          self.misses += 1
+          return obj
+    with self.lock:
+      self.hits += 1
+    return obj
+
+  def peek(self, key):
+    # Return the cached object for key without fetching, revalidating or counting
+    with self.lock:
+      entry = self.data.get(key, None)
+    return entry[0] if entry else None
+
+  def put(self, key, obj):
+    with self.lock:
+      self.data.pop(key, None)
+      self.data[key] = [obj, time()]
+      while len(self.data) > self.maxsize:
+        self.data.popitem(last=False)
+        self.evicted += 1
+
+  def evict(self, key):
+    with self.lock:
+      if self.data.pop(key, None) is not None:
+        self.evicted += 1
+
+  def items(self):
+    # Snapshot of (key, object) pairs: safe to iterate while other threads use the cache
+    with self.lock:
+      return [ (k,v[0]) for k,v in self.data.items() ]
+
+  def __contains__(self, key):
+    with self.lock:
+      return key in self.data
+
+  def __len__(self):
+    return len(self.data)
+
+  def stats(self):
+    return { "size": len(self.data), "maxsize": self.maxsize, "hits": self.hits,
+             "misses": self.misses, "revalidated": self.revalidated, "evicted": self.evicted }
+
+  def __str__(self):
+    return "%(name)s: %(size)d/%(maxsize)d entries, %(hits)d hits, %(misses)d misses, " \
+           "%(revalidated)d revalidated, %(evicted)d evicted" % dict(name=self.name, **self.stats())
+
 class MetaGitException(Exception):
   def __init__(self, message):
     self.message = str(message)
@@ -52,9 +139,13 @@ class MetaGit(object):
   def init(backend, **kw):
     if backend == "GitHub":
       return MetaGit_GitHub(**kw)
+    elif backend == "GraphQL":
+      return MetaGit_GraphQL(**kw)
     elif backend == "Dummy":
       return MetaGit_Dummy(**kw)
-    assert False, "You can only use GitHub or Dummy for now"
+    elif backend == "Cassette":
+      return MetaGit_Cassette(**kw)
+    assert False, "You can only use GitHub, GraphQL, Dummy or Cassette for now"
 
   def __init__(self, rw=True):
     self.rate_left = 0
@@ -77,6 +168,15 @@ class MetaGit(object):
       return d.state,d.description
     return None,None
 
+  def get_statuses_many(self, prs, contexts=None):
+    # Given an iterable of prs returns a dict mapping each pr to a dict of MetaStatus, as
+    # get_statuses() would. Backends may override it to fetch everything in one round trip
+    return dict((pr, self.get_statuses(pr, contexts)) for pr in prs)
+
+  def get_cache_stats(self):
+    # Return a list of strings describing the internal caches (empty if there are none)
+    return []
+
 class MetaGit_Dummy(MetaGit):
 
   def __init__(self, store="dummy", bot_user=None, rw=True, **kw):
@@ -196,12 +296,17 @@ class MetaGit_Dummy(MetaGit):
 
 class MetaGit_GitHub(MetaGit):
 
-  def __init__(self, token, rw=True, **kw):
+  GRAPHQL_URL = "https://api.github.com/graphql"
+  GRAPHQL_BATCH = 50  # pull requests per query
+
+  def __init__(self, token, rw=True, cache_size=2000, cache_ttl=300, **kw):
     super(MetaGit_GitHub, self).__init__(rw=rw)
+    self.token = token
     self.gh = Github(login_or_token=token)  # lazy
-    self.gh_commits = {}
-    self.gh_pulls = {}
-    self.gh_repos = {}
+    self.status_memo = {}  # sha -> {context: MetaStatus}, valid for the current batch only
+    self.gh_commits = MetaCache("commits", maxsize=cache_size, ttl=None)  # immutable
+    self.gh_pulls = MetaCache("pulls", maxsize=cache_size, ttl=cache_ttl)
+    self.gh_repos = MetaCache("repos", maxsize=100, ttl=86400)
 
   def get_rate_limit(self):
     # Returns a tuple with three elements: API calls left, limit, reset time (s)
@@ -211,36 +316,75 @@ class MetaGit_GitHub(MetaGit):
     except GithubException as e:
       raise MetaGitException("Cannot get GitHub rate limiting")
 
+  def get_cache_stats(self):
+    return [ str(c) for c in [self.gh_repos, self.gh_pulls, self.gh_commits] ]
+
+  def _repo(self, repo):
+    try:
+      return self.gh_repos.get(repo, lambda: self.gh.get_repo(repo))
+    except GithubException as e:
+      raise MetaGitException("Cannot get repository %s: %s" % (repo, e))
+
+  def _pull(self, pr, cached=True):
+    # Returns the PyGithub pull request object. If cached==False it is always revalidated.
+    # Commits of a superseded sha and closed pull requests are evicted from the caches
+    repo,num = self.split_repo_pr(pr)
+    gh_repo = self._repo(repo)
+    old = self.gh_pulls.peek(pr)
+    old_sha = old.head.sha if old is not None else None
+    try:
+      ghpr = self.gh_pulls.get(pr, lambda: gh_repo.get_pull(num), maxage=None if cached else 0)
+    except GithubException as e:
+      raise MetaGitException("Cannot get pull request %s: %s" % (pr, e))
+    if old_sha and old_sha != ghpr.head.sha:
+      debug("%s: head moved from %s to %s: evicting old commit" % (pr, old_sha, ghpr.head.sha))
+      self.gh_commits.evict(old_sha)
+    return ghpr
+
+  def _commit(self, pr, ghpr):
+    sha = ghpr.head.sha
+    try:
+      return self.gh_commits.get(sha, lambda: ghpr.base.repo.get_commit(sha))
+    except GithubException as e:
+      raise MetaGitException("Cannot get commit %s from %s: %s" % (sha, pr, e))
+
+  def _graphql(self, query):
+    # Run a GraphQL query and return its data. Partial results are returned with a warning
+    try:
+      r = post(self.GRAPHQL_URL, json={ "query": query },
+               headers={ "Authorization": "bearer %s" % self.token,
+                         # mergeStateStatus is still a preview
+                         "Accept": "application/vnd.github.merge-info-preview+json" }, timeout=60)
+      r.raise_for_status()
+      j = r.json()
+    except (RequestException,ValueError) as e:
+      raise MetaGitException("GraphQL query failed: %s" % e)
+    for err in j.get("errors", []):
+      warning("GraphQL: %s" % err.get("message", err))
+    if not j.get("data"):
+      raise MetaGitException("GraphQL query returned no data")
+    return j["data"]
+
+  def _forget(self, pr, ghpr):
+    # Closed pull requests will not be processed anymore: drop them from the caches
+    debug("%s: closed, evicting from cache" % pr)
+    self.gh_commits.evict(ghpr.head.sha)
+    self.gh_pulls.evict(pr)
+
   @apicalls
   def get_repo_info(self, repo):
-    if not repo in self.gh_repos:
-      try:
-        self.gh_repos[repo] = self.gh.get_repo(repo)
-      except GithubException as e:
-        raise MetaGitException("Cannot get repository %s: %s" % (repo, e))
-    return MetaRepo(owner = self.gh_repos[repo].owner.login,
-                    size  = self.gh_repos[repo].size)
+    gh_repo = self._repo(repo)
+    return MetaRepo(owner = gh_repo.owner.login,
+                    size  = gh_repo.size)
 
   @apicalls
   def get_pull(self, pr, cached=False):
-    # Given pr in group/repo#num format, returns a MetaPull with attributes. No cache by default
+    # Given pr in group/repo#num format, returns a MetaPull with attributes. Always revalidated
+    # by default
     repo,num = self.split_repo_pr(pr)
-    if not repo in self.gh_repos:
-      try:
-        self.gh_repos[repo] = self.gh.get_repo(repo)
-      except GithubException as e:
-        raise MetaGitException("Cannot get repository %s: %s" % (repo, e))
-    if not cached or not pr in self.gh_pulls:
-      try:
-        self.gh_pulls[pr] = self.gh_repos[repo].get_pull(num)
-      except GithubException as e:
-        raise MetaGitException("Cannot get pull request %s: %s" % (pr, e))
-    sha = self.gh_pulls[pr].head.sha
-    if not sha in self.gh_commits:
-      try:
-        self.gh_commits[sha] = self.gh_pulls[pr].base.repo.get_commit(sha)
-      except GithubException as e:
-        raise MetaGitException("Cannot get commit %s from %s: %s" % (pull.sha, pr, e))
+    ghpr = self._pull(pr, cached=cached)
+    sha = ghpr.head.sha
+    gh_commit = self._commit(pr, ghpr)
     def wrap_get_files(ghpr):
       try:
         for f in ghpr.get_files():
@@ -250,40 +394,45 @@ class MetaGit_GitHub(MetaGit):
     pull = MetaPull(name            = pr,
                     repo            = repo,
                     num             = num,
-                    title           = self.gh_pulls[pr].title,
-                    changed_files   = self.gh_pulls[pr].changed_files,
+                    title           = ghpr.title,
+                    changed_files   = ghpr.changed_files,
                     sha             = sha,
-                    closed_at       = self.gh_pulls[pr].closed_at,
-                    mergeable       = self.gh_pulls[pr].mergeable,
-                    mergeable_state = self.gh_pulls[pr].mergeable_state,
-                    who             = self.gh_pulls[pr].user.login,
-                    when            = self.gh_commits[sha].commit.committer.date,
-                    get_files       = lambda: wrap_get_files(self.gh_pulls[pr]))
+                    closed_at       = ghpr.closed_at,
+                    mergeable       = ghpr.mergeable,
+                    mergeable_state = ghpr.mergeable_state,
+                    who             = ghpr.user.login,
+                    when            = gh_commit.commit.committer.date,
+                    get_files       = lambda: wrap_get_files(ghpr))
+    if pull.closed_at:
+      self._forget(pr, ghpr)
     return pull
 
   @apicalls
   def get_pulls(self, repo):
     # Returns a set of pull requests for this repository, and caches the objects
-    if not repo in self.gh_repos:
-      try:
-        self.gh_repos[repo] = self.gh.get_repo(repo)
-      except GithubException as e:
-        raise MetaGitException("Cannot get repository %s: %s" % (repo, e))
+    gh_repo = self._repo(repo)
     all_pulls = set()
     try:
-      for p in self.gh_repos[repo].get_pulls():
+      for p in gh_repo.get_pulls():
         pr = repo + "#" + str(p.number)
-        self.gh_pulls[pr] = p
+        old = self.gh_pulls.peek(pr)
+        if old is not None and old.head.sha != p.head.sha:
+          self.gh_commits.evict(old.head.sha)
+        self.gh_pulls.put(pr, p)
         all_pulls.add(pr)
     except GithubException as e:
       raise MetaGitException("Cannot get list of pull requests for %s" % repo)
+    # Pull requests not open anymore are evicted
+    for pr,p in self.gh_pulls.items():
+      if pr.startswith(repo + "#") and not pr in all_pulls:
+        self._forget(pr, p)
     return all_pulls
 
   @apicalls
   def get_pull_from_sha(self, sha):
     # Returns a pull request object from the sha, if cached. None if not found
-    for pr in self.gh_pulls:
-      if self.gh_pulls[pr].head.sha == sha:
+    for pr,p in self.gh_pulls.items():
+      if p.head.sha == sha:
         return self.get_pull(pr, cached=True)
     return None
 
@@ -291,15 +440,14 @@ class MetaGit_GitHub(MetaGit):
   def get_statuses(self, pr, contexts=None):
     # Given a pr and an array of contexts returns a dict of MetaStatus. If the array of contexts is
     # not given, get all statuses. If status is not found, it will not appear in the returned dict
-    pull = self.get_pull(pr, cached=True)
-    if not pull.sha in self.gh_commits:
-      try:
-        self.gh_commits[pull.sha] = self.gh_pulls[pr].base.repo.get_commit(pull.sha)
-      except GithubException as e:
-        raise MetaGitException("Cannot get commit %s from %s: %s" % (pull.sha, pr, e))
+    ghpr = self._pull(pr)
+    if ghpr.head.sha in self.status_memo:
+      return dict((c,s) for c,s in self.status_memo[ghpr.head.sha].items()
+                        if not contexts or c in contexts)
+    gh_commit = self._commit(pr, ghpr)
     statuses = {}
     try:
-      for s in self.gh_commits[pull.sha].get_statuses():
+      for s in gh_commit.get_statuses():
         if (not contexts or s.context in contexts) and not s.context in statuses:
           sn = MetaStatus(context     = s.context,
                           state       = s.state,
@@ -308,9 +456,43 @@ class MetaGit_GitHub(MetaGit):
           if contexts and len(statuses) == len(contexts):
             break
     except GithubException as e:
-      raise MetaGitException("Cannot get statuses for %s on %s: %s" % (pull.sha, pr, e))
+      raise MetaGitException("Cannot get statuses for %s on %s: %s" % (gh_commit.sha, pr, e))
     return statuses
 
+  @apicalls
+  def get_statuses_many(self, prs, contexts=None):
+    # Fetches the latest statuses of many pull requests with one GraphQL query per
+    # GRAPHQL_BATCH of them. Results are memoised per sha, and get_statuses() and set_status()
+    # use them until the next call to this function
+    self.status_memo = {}
+    prs = sorted(set(prs))
+    result = {}
+    for i in range(0, len(prs), self.GRAPHQL_BATCH):
+      batch = prs[i:i+self.GRAPHQL_BATCH]
+      query = []
+      for n,pr in enumerate(batch):
+        repo,num = self.split_repo_pr(pr)
+        owner,name = repo.split("/", 1)
+        query.append('pr%d: repository(owner: "%s", name: "%s") { pullRequest(number: %d) { '
+                     'commits(last: 1) { nodes { commit { oid status { contexts { '
+                     'context state description } } } } } } }' % (n, owner, name, num))
+      data = self._graphql("query { %s }" % " ".join(query))
+      for n,pr in enumerate(batch):
+        try:
+          commit = data["pr%d" % n]["pullRequest"]["commits"]["nodes"][0]["commit"]
+        except (KeyError,IndexError,TypeError):
+          warning("%s: cannot get statuses via GraphQL" % pr)
+          continue
+        if not commit["oid"] in self.status_memo:
+          self.status_memo[commit["oid"]] = dict(
+            (c["context"], MetaStatus(context     = c["context"],
+                                      state       = c["state"].lower(),
+                                      description = c["description"]))
+            for c in ((commit.get("status") or {}).get("contexts") or []))
+        result[pr] = dict((c,s) for c,s in self.status_memo[commit["oid"]].items()
+                                if not contexts or c in contexts)
+    return result
+
   @apicalls
   def set_status(self, pr, context, state, description="", force=False):
     # Set status for a given pr. If force==True set it even if it already exists
@@ -318,14 +500,15 @@ class MetaGit_GitHub(MetaGit):
       info("%s: not setting %s=%s (dry run)" % (pr, context, state))
       return
     info("%s: setting %s=%s" % (pr, context, state))
-    pull = self.get_pull(pr, cached=True)
-    if not pull.sha in self.gh_commits:
-      try:
-        self.gh_commits[pull.sha] = self.gh_pulls[pr].base.repo.get_commit(pull.sha)
-      except GithubException as e:
-        raise MetaGitException("Cannot get commit %s from %s: %s" % (pull.sha, pr, e))
-    gh_commit = self.gh_commits[pull.sha]
-    if not force:
+    ghpr = self._pull(pr)
+    gh_commit = self._commit(pr, ghpr)
+    # The memo might be outdated (statuses can be changed by others since it was filled): it only
+    # spares reading statuses which have to be written anyway. Statuses it shows as already set
+    # are read again before skipping
+    s = self.status_memo.get(gh_commit.sha, {}).get(context, None)
+    memo_differs = gh_commit.sha in self.status_memo and \
+                   (not s or s.state != state or s.description != description)
+    if not force and not memo_differs:
       try:
         for s in gh_commit.get_statuses():
           if s.context == context:
@@ -334,12 +517,16 @@ class MetaGit_GitHub(MetaGit):
               return
             break
       except GithubException as e:
-        raise MetaGitException("Cannot verify statuses for %s on %s: %s" % (pull.sha, pr, e))
+        raise MetaGitException("Cannot verify statuses for %s on %s: %s" % (gh_commit.sha, pr, e))
     try:
       gh_commit.create_status(state, description=description, context=context)
     except GithubException as e:
       raise MetaGitException("Cannot add state %s=%s (%s) to %s on %s: %s" % \
-                             (context, state, description, pull.sha, pr, e))
+                             (context, state, description, gh_commit.sha, pr, e))
+    if gh_commit.sha in self.status_memo:
+      self.status_memo[gh_commit.sha][context] = MetaStatus(context     = context,
+                                                            state       = state,
+                                                            description = description)
 
   @apicalls
   def add_comment(self, pr, comment):
@@ -348,18 +535,18 @@ class MetaGit_GitHub(MetaGit):
       info("%s: not adding comment \"%s\" (dry run)" % (pr, comment))
       return
     info("%s: adding comment \"%s\"" % (pr, comment))
-    self.get_pull(pr, cached=True)
+    ghpr = self._pull(pr)
     try:
-      self.gh_pulls[pr].create_issue_comment(comment)
+      ghpr.create_issue_comment(comment)
     except GithubException as e:
       raise MetaGitException("Cannot create comment %s on %s: %s" % (comment, pr, e))
 
   @apicalls
   def get_comments(self, pr):
     # Gets all comments in a pull request. Based on generators
-    self.get_pull(pr, cached=True)
+    ghpr = self._pull(pr)
     try:
-      for c in self.gh_pulls[pr].get_issue_comments():
+      for c in ghpr.get_issue_comments():
         cn = MetaComment(body  = c.body,
                          short = c.body.split("\n", 1)[0].strip(),
                          who   = c.user.login,
@@ -375,8 +562,474 @@ class MetaGit_GitHub(MetaGit):
       info("%s: not merging (dry run)" % pr)
       return
     info("%s: merging" % pr)
-    self.get_pull(pr, cached=True)
+    ghpr = self._pull(pr)
     try:
-      self.gh_pulls[pr].merge()
+      ghpr.merge()
     except GithubException as e:
       raise MetaGitException("Cannot merge %s: %s" % (pr, e))
+    self._forget(pr, ghpr)
+
+class GraphQLPull(object):
+  # All we need to know about a pull request, as read from a GraphQL pullRequest node.
+  # update() reads it again (used by MetaCache when the entry expires)
+  def __init__(self, pr, node, refetch):
+    self.refetch = refetch
+    repo,num = MetaGit.split_repo_pr(pr)
+    commit = node["commits"]["nodes"][0]["commit"]
+    self.pull = MetaPull(name            = pr,
+                         repo            = repo,
+                         num             = num,
+                         title           = node["title"],
+                         changed_files   = node["changedFiles"],
+                         sha             = commit["oid"],
+                         closed_at       = gqldate(node["closedAt"]),
+                         mergeable       = { "MERGEABLE": True, "CONFLICTING": False }.get(node["mergeable"], None),
+                         mergeable_state = (node.get("mergeStateStatus") or "unknown").lower(),
+                         who             = gqllogin(node["author"]),
+                         when            = gqldate(commit["committedDate"]),
+                         get_files       = None)
+    self.sha = commit["oid"]
+    self.files = [ f["path"] for f in node["files"]["nodes"] ]
+    self.files_cursor = gqlcursor(node["files"])
+    self.comments = [ gqlcomment(c) for c in node["comments"]["nodes"] ]
+    self.comments_cursor = gqlcursor(node["comments"])
+    self.statuses = dict((c["context"], MetaStatus(context     = c["context"],
+                                                   state       = c["state"].lower(),
+                                                   description = c["description"]))
+                         for c in ((commit.get("status") or {}).get("contexts") or []))
+
+  def update(self):
+    fresh = self.refetch()
+    self.__dict__.update(fresh.__dict__)
+    return True
+
+def gqldate(s):
+  return datetime.strptime(s, "%Y-%m-%dT%H:%M:%SZ") if s else None
+
+def gqllogin(author):
+  return author["login"] if author else "ghost"  # deleted users have no author
+
+def gqlcursor(conn):
+  return conn["pageInfo"]["endCursor"] if conn["pageInfo"]["hasNextPage"] else None
+
+def gqlcomment(c):
+  return MetaComment(body  = c["body"],
+                     short = c["body"].split("\n", 1)[0].strip(),
+                     who   = gqllogin(c["author"]),
+                     when  = gqldate(c["createdAt"]))
+
+class MetaGit_GraphQL(MetaGit_GitHub):
+  # Reads the pull request, its head commit, changed files, comments and statuses with a single
+  # GraphQL query, or those of many pull requests with one query per GRAPHQL_BATCH of them. More
+  # than 100 files or comments need one more query per page. Writes are single REST calls
+
+  REST_URL = "https://api.github.com"
+  GRAPHQL_BATCH = 20
+  NODE_FIELDS = { "files": "path",
+                  "comments": "body createdAt author { login }" }
+  PULL_FIELDS = "title changedFiles closedAt mergeable mergeStateStatus author { login } " \
+                "files(first: 100) { pageInfo { hasNextPage endCursor } nodes { path } } " \
+                "comments(first: 100) { pageInfo { hasNextPage endCursor } " \
+                "nodes { body createdAt author { login } } } " \
+                "commits(last: 1) { nodes { commit { oid committedDate " \
+                "status { contexts { context state description } } } } }"
+
+  def __init__(self, token, rw=True, cache_size=2000, cache_ttl=300, **kw):
+    super(MetaGit_GraphQL, self).__init__(token=token, rw=rw, cache_size=cache_size,
+                                          cache_ttl=cache_ttl, **kw)
+    self.gql_pulls = MetaCache("pulls", maxsize=cache_size, ttl=cache_ttl)
+    self.batch = set()  # pull requests read by the last get_statuses_many(), not used yet
+
+  def get_rate_limit(self):
+    # GraphQL has its own rate limit, which is read with every query
+    return self.rate_left,self.rate_limit,self.rate_reset
+
+  def get_cache_stats(self):
+    return [ str(self.gql_pulls) ]
+
+  def _query(self, body):
+    data = self._graphql("query { rateLimit { limit remaining resetAt } %s }" % body)
+    rl = data.get("rateLimit") or {}
+    self.rate_left = rl.get("remaining", self.rate_left)
+    self.rate_limit = rl.get("limit", self.rate_limit)
+    if rl.get("resetAt"):
+      self.rate_reset = calendar.timegm(gqldate(rl["resetAt"]).timetuple())
+    return data
+
+  def _rest(self, method, path, payload):
+    try:
+      r = request(method, self.REST_URL + path, json=payload, timeout=60,
+                  headers={ "Authorization": "token %s" % self.token })
+      r.raise_for_status()
+    except RequestException as e:
+      raise MetaGitException(e)
+
+  def _fetch(self, prs):
+    # Reads the given pull requests with a single query. Returns a dict of GraphQLPull
+    query = []
+    for n,pr in enumerate(prs):
+      repo,num = self.split_repo_pr(pr)
+      owner,name = repo.split("/", 1)
+      query.append('pr%d: repository(owner: "%s", name: "%s") { pullRequest(number: %d) { %s } }' % \
+                   (n, owner, name, num, self.PULL_FIELDS))
+    data = self._query(" ".join(query))
+    pulls = {}
+    for n,pr in enumerate(prs):
+      try:
+        node = data["pr%d" % n]["pullRequest"]
+        pulls[pr] = GraphQLPull(pr, node, lambda pr=pr: self._fetch_one(pr))
+      except (KeyError,IndexError,TypeError) as e:
+        warning("%s: cannot read pull request via GraphQL: %s" % (pr, e))
+        continue
+      self.status_memo[pulls[pr].sha] = pulls[pr].statuses
+    return pulls
+
+  def _fetch_one(self, pr):
+    p = self._fetch([pr]).get(pr, None)
+    if p is None:
+      raise MetaGitException("Cannot get pull request %s" % pr)
+    return p
+
+  def _gpull(self, pr, cached=True):
+    p = self.gql_pulls.get(pr, lambda: self._fetch_one(pr), maxage=None if cached else 0)
+    if p.pull.closed_at:
+      debug("%s: closed, evicting from cache" % pr)
+      self.gql_pulls.evict(pr)
+    return p
+
+  def _more(self, pr, what, cursor):
+    # Reads the next page of files or comments. Returns the nodes and the next cursor
+    repo,num = self.split_repo_pr(pr)
+    owner,name = repo.split("/", 1)
+    data = self._query('repository(owner: "%s", name: "%s") { pullRequest(number: %d) { '
+                       '%s(first: 100, after: "%s") { pageInfo { hasNextPage endCursor } '
+                       'nodes { %s } } } }' % (owner, name, num, what, cursor, self.NODE_FIELDS[what]))
+    try:
+      conn = data["repository"]["pullRequest"][what]
+    except (KeyError,TypeError):
+      raise MetaGitException("Cannot get %s for %s" % (what, pr))
+    return conn["nodes"],gqlcursor(conn)
+
+  @apicalls
+  def get_pull(self, pr, cached=False):
+    # Given pr in group/repo#num format, returns a MetaPull with attributes. Pull requests read
+    # by the last get_statuses_many() are not read again the first time they are requested
+    if not cached and pr in self.batch:
+      self.batch.discard(pr)
+      cached = True
+    p = self._gpull(pr, cached=cached)
+    def get_files():
+      for f in p.files:
+        yield f
+      while p.files_cursor:
+        nodes,p.files_cursor = self._more(pr, "files", p.files_cursor)
+        for f in nodes:
+          p.files.append(f["path"])
+          yield f["path"]
+    return p.pull._replace(get_files=get_files)
+
+  @apicalls
+  def get_pulls(self, repo):
+    # Returns the set of open pull requests for this repository
+    owner,name = repo.split("/", 1)
+    all_pulls = set()
+    cursor = None
+    while True:
+      data = self._query('repository(owner: "%s", name: "%s") { pullRequests(states: OPEN, first: 100%s) { '
+                         'pageInfo { hasNextPage endCursor } nodes { number } } }' % \
+                         (owner, name, ', after: "%s"' % cursor if cursor else ""))
+      try:
+        conn = data["repository"]["pullRequests"]
+      except (KeyError,TypeError):
+        raise MetaGitException("Cannot get list of pull requests for %s" % repo)
+      all_pulls.update([ "%s#%d" % (repo, p["number"]) for p in conn["nodes"] ])
+      cursor = gqlcursor(conn)
+      if not cursor:
+        break
+    for pr,_ in self.gql_pulls.items():
+      if pr.startswith(repo + "#") and not pr in all_pulls:
+        self.gql_pulls.evict(pr)
+    return all_pulls
+
+  @apicalls
+  def get_pull_from_sha(self, sha):
+    # Returns a pull request object from the sha, if cached. None if not found
+    for pr,p in self.gql_pulls.items():
+      if p.sha == sha:
+        return self.get_pull(pr, cached=True)
+    return None
+
+  @apicalls
+  def get_statuses(self, pr, contexts=None):
+    # Given a pr and an array of contexts returns a dict of MetaStatus. If the array of contexts is
+    # not given, get all statuses. If status is not found, it will not appear in the returned dict
+    p = self._gpull(pr)
+    statuses = self.status_memo.get(p.sha, p.statuses)
+    return dict((c,s) for c,s in statuses.items() if not contexts or c in contexts)
+
+  @apicalls
+  def get_statuses_many(self, prs, contexts=None):
+    # Reads all given pull requests, GRAPHQL_BATCH per query, and returns their statuses
+    self.status_memo = {}
+    self.batch = set()
+    prs = sorted(set(prs))
+    result = {}
+    for i in range(0, len(prs), self.GRAPHQL_BATCH):
+      for pr,p in self._fetch(prs[i:i+self.GRAPHQL_BATCH]).items():
+        self.gql_pulls.put(pr, p)
+        self.batch.add(pr)
+        result[pr] = dict((c,s) for c,s in p.statuses.items() if not contexts or c in contexts)
+    return result
+
+  @apicalls
+  def set_status(self, pr, context, state, description="", force=False):
+    # Set status for a given pr. If force==True set it even if it already exists
+    if not self.rw:
+      info("%s: not setting %s=%s (dry run)" % (pr, context, state))
+      return
+    info("%s: setting %s=%s" % (pr, context, state))
+    p = self._gpull(pr)
+    statuses = self.status_memo.setdefault(p.sha, p.statuses)
+    s = statuses.get(context, None)
+    if not force and s and s.state == state and s.description == description:
+      # Statuses might have been changed by others since they were read: read them again before
+      # skipping
+      p = self._gpull(pr, cached=False)
+      statuses = self.status_memo[p.sha] = p.statuses
+      s = statuses.get(context, None)
+    if not force and s and s.state == state and s.description == description:
+      debug("%s: %s=%s already set" % (pr, context, state))
+      return
+    try:
+      self._rest("POST", "/repos/%s/statuses/%s" % (p.pull.repo, p.sha),
+                 { "state": state, "description": description, "context": context })
+    except MetaGitException as e:
+      raise MetaGitException("Cannot add state %s=%s (%s) to %s on %s: %s" % \
+                             (context, state, description, p.sha, pr, e))
+    statuses[context] = MetaStatus(context=context, state=state, description=description)
+
+  @apicalls
+  def add_comment(self, pr, comment):
+    # Add a comment to a pull request
+    if not self.rw:
+      info("%s: not adding comment \"%s\" (dry run)" % (pr, comment))
+      return
+    info("%s: adding comment \"%s\"" % (pr, comment))
+    repo,num = self.split_repo_pr(pr)
+    try:
+      self._rest("POST", "/repos/%s/issues/%d/comments" % (repo, num), { "body": comment })
+    except MetaGitException as e:
+      raise MetaGitException("Cannot create comment %s on %s: %s" % (comment, pr, e))
+
+  @apicalls
+  def get_comments(self, pr):
+    # Gets all comments in a pull request. Based on generators
+    p = self._gpull(pr)
+    for c in p.comments:
+      yield c
+    while p.comments_cursor:
+      nodes,p.comments_cursor = self._more(pr, "comments", p.comments_cursor)
+      for c in map(gqlcomment, nodes):
+        p.comments.append(c)
+        yield c
+
+  @apicalls
+  def merge(self, pr):
+    # Merge a pull request
+    if not self.rw:
+      info("%s: not merging (dry run)" % pr)
+      return
+    info("%s: merging" % pr)
+    repo,num = self.split_repo_pr(pr)
+    try:
+      self._rest("PUT", "/repos/%s/pulls/%d/merge" % (repo, num), {})
+    except MetaGitException as e:
+      raise MetaGitException("Cannot merge %s: %s" % (pr, e))
+    self.gql_pulls.evict(pr)
+
+class MetaGit_Cassette(MetaGit):
+  # Records all calls made to the GitHub (or GraphQL, see wrapped) backend, with their results,
+  # to a YAML cassette (mode="record"), or serves them back without network access (mode="replay"), optionally
+  # sleeping latency seconds per call. Calls with the same arguments are replayed in the order
+  # they were recorded; the last result is repeated when they run out
+
+  def __init__(self, cassette, mode="replay", latency=0, wrapped="GitHub", rw=True, **kw):
+    super(MetaGit_Cassette, self).__init__(rw=rw)
+    self.cassette = cassette
+    self.mode = mode
+    self.latency = latency
+    self.lock = RLock()
+    self.pos = {}
+    self.replayed = 0
+    self.missing = 0
+    if mode == "record":
+      assert wrapped in [ "GitHub", "GraphQL" ], "Cassettes can only record GitHub or GraphQL"
+      self.backend = MetaGit.init(backend=wrapped, rw=rw, **kw)
+      self.tape = {}
+      atexit.register(self.save)
+    elif mode == "replay":
+      self.backend = None
+      try:
+        self.tape = yaml.safe_load(open(cassette)) or {}
+      except (IOError,yaml.YAMLError) as e:
+        raise MetaGitException("Cannot read cassette %s: %s" % (cassette, e))
+    else:
+      raise MetaGitException("Cassette mode can be record or replay, not %s" % mode)
+
+  def save(self):
+    if self.mode != "record":
+      return
+    with self.lock:
+      try:
+        with open(self.cassette, "w") as f:
+          f.write(yaml.safe_dump(self.tape, default_flow_style=False, width=1000000, indent=2))
+      except IOError as e:
+        raise MetaGitException("Cannot write cassette %s: %s" % (self.cassette, e))
+    info("Cassette %s: recorded %d distinct calls" % (self.cassette, len(self.tape)))
+
+  @staticmethod
+  def _key(name, args, kw):
+    # Arguments order in lists (e.g. contexts) and cache hints do not change results
+    norm = lambda a: sorted(a) if isinstance(a, (list,tuple,set,frozenset)) else a
+    kw = dict((k,norm(v)) for k,v in kw.items() if k != "cached")
+    return "%s %s" % (name, json.dumps([ [ norm(a) for a in args ], kw ], sort_keys=True))
+
+  @staticmethod
+  def _encode(obj):
+    enc = MetaGit_Cassette._encode
+    if isinstance(obj, MetaPull):
+      d = dict(obj._asdict())
+      del d["get_files"]  # recorded lazily, when called
+      return { "__type__": "MetaPull", "value": d }
+    for t in [ MetaComment, MetaStatus, MetaRepo ]:
+      if isinstance(obj, t):
+        return { "__type__": t.__name__, "value": dict(obj._asdict()) }
+    if isinstance(obj, (set,frozenset)):
+      return { "__type__": "set", "value": sorted(obj) }
+    if isinstance(obj, dict):
+      return dict((k,enc(v)) for k,v in obj.items())
+    if isinstance(obj, (list,tuple)):
+      return [ enc(x) for x in obj ]
+    return obj
+
+  @staticmethod
+  def _decode(obj):
+    dec = MetaGit_Cassette._decode
+    if isinstance(obj, dict) and "__type__" in obj:
+      t,v = obj["__type__"],obj["value"]
+      if t == "MetaPull":
+        files = obj.get("files", None)
+        def get_files():
+          if files is None:
+            raise MetaGitException("Cannot get list of files from pull request: not recorded")
+          return iter(files)
+        return MetaPull(get_files=get_files, **v)
+      if t == "set":
+        return set(v)
+      return { "MetaComment": MetaComment, "MetaStatus": MetaStatus, "MetaRepo": MetaRepo }[t](**v)
+    if isinstance(obj, dict):
+      return dict((k,dec(v)) for k,v in obj.items())
+    if isinstance(obj, list):
+      return [ dec(x) for x in obj ]
+    return obj
+
+  def _record(self, name, *args, **kw):
+    entry = {}
+    try:
+      res = getattr(self.backend, name)(*args, **kw)
+      if name == "get_comments":
+        res = list(res)
+      entry["result"] = self._encode(res)
+    except MetaGitException as e:
+      entry["error"] = str(e)
+    with self.lock:
+      self.tape.setdefault(self._key(name, args, kw), []).append(entry)
+    if "error" in entry:
+      raise MetaGitException(entry["error"])
+    if isinstance(res, MetaPull):
+      backend_get_files = res.get_files
+      def get_files():
+        try:
+          files = list(backend_get_files())
+        except MetaGitException as e:
+          entry["result"]["files_error"] = str(e)
+          raise
+        entry["result"]["files"] = files
+        return iter(files)
+      res = res._replace(get_files=get_files)
+    elif name == "get_comments":
+      res = iter(res)
+    return res
+
+  def _replay(self, name, *args, **kw):
+    sleep(self.latency)
+    key = self._key(name, args, kw)
+    with self.lock:
+      entries = self.tape.get(key, None)
+      if not entries:
+        self.missing += 1
+        raise MetaGitException("Cassette %s: call not recorded: %s" % (self.cassette, key))
+      n = self.pos.get(key, 0)
+      self.pos[key] = n+1
+      self.replayed += 1
+    entry = entries[min(n, len(entries)-1)]
+    if "error" in entry:
+      raise MetaGitException(entry["error"])
+    res = self._decode(entry["result"])
+    if isinstance(res, MetaPull) and "files_error" in entry["result"]:
+      def get_files():
+        raise MetaGitException(entry["result"]["files_error"])
+      res = res._replace(get_files=get_files)
+    return iter(res) if name == "get_comments" else res
+
+  def _call(self, name, *args, **kw):
+    if self.mode == "record":
+      return self._record(name, *args, **kw)
+    return self._replay(name, *args, **kw)
+
+  def get_rate_limit(self):
+    if self.mode == "record":
+      return self.backend.get_rate_limit()
+    return 0,0,time()
+
+  def get_cache_stats(self):
+    if self.mode == "record":
+      return self.backend.get_cache_stats()
+    return [ "cassette %s: %d calls replayed, %d not recorded" % \
+             (self.cassette, self.replayed, self.missing) ]
+
+  def get_repo_info(self, repo):
+    return self._call("get_repo_info", repo)
+
+  def get_pull(self, pr, cached=False):
+    return self._call("get_pull", pr, cached=cached)
+
+  def get_pulls(self, repo):
+    return self._call("get_pulls", repo)
+
+  def get_pull_from_sha(self, sha):
+    return self._call("get_pull_from_sha", sha)
+
+  def get_statuses(self, pr, contexts=None):
+    return self._call("get_statuses", pr, contexts)
+
+  def get_statuses_many(self, prs, contexts=None):
+    return self._call("get_statuses_many", prs, contexts)
+
+  def set_status(self, pr, context, state, description="", force=False):
+    if self.mode == "replay":
+      info("%s: setting %s=%s (replay)" % (pr, context, state))
+    return self._call("set_status", pr, context, state, description=description, force=force)
+
+  def get_comments(self, pr):
+    return self._call("get_comments", pr)
+
+  def add_comment(self, pr, comment):
+    if self.mode == "replay":
+      info("%s: adding comment \"%s\" (replay)" % (pr, comment))
+    return self._call("add_comment", pr, comment)
+
+  def merge(self, pr):
+    if self.mode == "replay":
+      info("%s: merging (replay)" % pr)
+    return self._call("merge", pr)
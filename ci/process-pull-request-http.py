@@ -347,17 +347,24 @@ class PrRPC(object):
   items = set()
 
   def __init__(self, host, port, bot_user, admins, processQueueEvery, processAllEvery,
-               processStuckThreshold, dummyGit, dryRun):
+               processStuckThreshold, dummyGit, dryRun, cassette=None, cassetteMode="replay",
+               cassetteLatency=0, graphql=False):
     self.bot_user = bot_user
     self.admins = admins
     self.dryRun = dryRun
     self.must_exit = False
     self.processStartTime = 0
     self.processStuckThreshold = processStuckThreshold
-    self.git = MetaGit.init(backend="Dummy" if dummyGit else "GitHub",
+    backend = "GraphQL" if graphql else "GitHub"
+    self.git = MetaGit.init(backend="Cassette" if cassette else ("Dummy" if dummyGit else backend),
+                            wrapped=backend,
                             bot_user=bot_user,
                             store="dummy",
-                            token=open(expanduser("~/.github-token")).read().strip(),
+                            cassette=cassette,
+                            mode=cassetteMode,
+                            latency=cassetteLatency,
+                            token=None if cassetteMode == "replay" and cassette \
+                                  else open(expanduser("~/.github-token")).read().strip(),
                             rw=not dryRun)
 
     def set_must_exit():
@@ -416,6 +423,12 @@ class PrRPC(object):
     #debug("GitHub to full names mapping:\n"+json.dumps(usermap, indent=2))
     setattr(Approvers, "usermap", usermap)
 
+    # Fetch the statuses of all pull requests at once: single statuses are read from there
+    try:
+      self.git.get_statuses_many([ pr for pr in prs if pr.split("#", 1)[0] in perms ])
+    except MetaGitException as e:
+      warning("Cannot prefetch statuses, getting them one by one: %s" % e)
+
     for pr in prs:
       if self.must_exit:
         info("Interrupting loop: must exit")
@@ -445,6 +458,8 @@ class PrRPC(object):
       # PR can be removed from list
       if ok:
         unprocessed.remove(pr)
+    for c in self.git.get_cache_stats():
+      info("Cache %s" % c)
     return unprocessed  # empty set in case of full success
 
   def pull_state_machine(self, pr, perms, tests, bot_user, admins, dryRun):
@@ -559,6 +574,10 @@ class PrRPC(object):
     self.items.add(pr)
     return self.j(req, {"added_to_queue": pr})
 
+  @app.route("/cache")
+  def get_cache_stats(self, req):
+    return self.j(req, {"caches": self.git.get_cache_stats()})
+
   @app.route("/health")
   def health(self, req):
     runningSince = time()-self.processStartTime if self.processStartTime else 0
@@ -697,6 +716,15 @@ if __name__ == "__main__":
   parser.add_argument("--dummy-git", dest="dummyGit",
                       action="store_true", default=False,
                       help="Use the dummy Git backend for testing")
+  parser.add_argument("--graphql", dest="graphql",
+                      action="store_true", default=False,
+                      help="Read pull requests with the GitHub GraphQL API (fewer API calls)")
+  parser.add_argument("--record", dest="record", default=None,
+                      help="Record all GitHub calls and results to this cassette file")
+  parser.add_argument("--replay", dest="replay", default=None,
+                      help="Replay GitHub calls from this cassette file, without network access")
+  parser.add_argument("--replay-latency", dest="replayLatency", default=0, type=float,
+                      help="Synthetic latency in seconds for each replayed call (default: 0)")
   args = parser.parse_args()
   if args.more_debug:
     args.debug = True
@@ -708,6 +736,8 @@ if __name__ == "__main__":
     parser.error("--process-queue-every must be at least 5 seconds")
   if args.processAllEvery > 0 and args.processAllEvery < 10:
     parser.error("--process-all-every must be either 0 (disable) or at least 10 seconds")
+  if args.record and args.replay:
+    parser.error("--record and --replay are mutually exclusive")
 
   logger = logging.getLogger()
   loggerHandler = logging.StreamHandler()
@@ -726,4 +756,8 @@ if __name__ == "__main__":
                 processAllEvery=args.processAllEvery,
                 processStuckThreshold=args.processStuckThreshold,
                 dummyGit=args.dummyGit,
-                dryRun=args.dryRun)
+                dryRun=args.dryRun,
+                cassette=args.record or args.replay,
+                cassetteMode="record" if args.record else "replay",
+                cassetteLatency=args.replayLatency,
+                graphql=args.graphql)
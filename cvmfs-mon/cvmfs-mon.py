@@ -2,7 +2,10 @@
 from __future__ import print_function
 from requests import get
 from requests.exceptions import RequestException
-import yaml, time, os
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+from tempfile import NamedTemporaryFile
+import yaml, time, os, json
 from datetime import datetime
 from sys import exit
 from smtplib import SMTP
@@ -40,39 +43,128 @@ def getint(d, key, default):
   except ValueError:
     return default
 
-def check(monit):
-  for repo in monit["repos"]:
-    for stratum_name in monit["repos"][repo]:
+def fetch(monit, repo, stratum_name):
+  try:
+    s = get(monit["repos"][repo][stratum_name]["url"], timeout=monit["timeout"]).json()
+    return repo, stratum_name, { "s0_rev": s["stratum0"]["revision"],
+                                 "s1_rev": s["stratum1"]["revision"],
+                                 "s0_mod": s["stratum0"]["last_modified"],
+                                 "s1_mod": s["stratum1"]["last_modified"],
+                                 "ok": s["status"] == "ok" }, None
+  except (RequestException,KeyError,ValueError,TypeError) as e:
+    return repo, stratum_name, None, e
+
+def load_history(fn):
+  try:
+    return json.load(open(fn))
+  except (IOError,ValueError) as e:
+    print("starting with an empty history: cannot read %s: %s" % (fn, e))
+    return {}
+
+def save_history(fn, history):
+  try:
+    with NamedTemporaryFile("w", dir=os.path.dirname(os.path.abspath(fn)), delete=False) as fp:
+      json.dump(history, fp)
+    os.rename(fp.name, fn)
+  except (IOError,OSError) as e:
+    print("cannot save history to %s: %s" % (fn, e))
+
+def slope(points):
+  # Least squares slope of [ (t, y), ... ], per second
+  n = float(len(points))
+  mt = sum(t for t,_ in points)/n
+  my = sum(y for _,y in points)/n
+  var = sum((t-mt)**2 for t,_ in points)
+  return sum((t-mt)*(y-my) for t,y in points)/var if var else 0.
+
+def trend(samples, n):
+  # From the last n samples (if all of them are lagging): stratum 1 throughput (revisions per
+  # second), rate at which the lag is shrinking, and predicted seconds to sync (None if the lag is
+  # not shrinking). None if there are not enough lagging samples
+  window = samples[-n:]
+  if n < 2 or len(window) < n or [ x for x in window if x[1] == x[2] ]:
+    return None
+  throughput = slope([ (t, s1) for t,s0,s1 in window ])
+  closing = -slope([ (t, s0-s1) for t,s0,s1 in window ])
+  eta = (window[-1][1]-window[-1][2])/closing if closing > 0 else None
+  return throughput, closing, eta
+
+def fetch_all(monit, strata):
+  # Query all strata concurrently. The timeout of each request applies to every socket operation:
+  # strata not answering within monit["timeout"] seconds in total are reported as failed
+  pool = ThreadPool(max(1, min(monit["parallel"], len(strata))))
+  try:
+    pending = [ pool.apply_async(fetch, (monit, repo, stratum_name)) for repo,stratum_name in strata ]
+    deadline = time.time() + monit["timeout"]
+    results = []
+    for (repo,stratum_name),r in zip(strata, pending):
       try:
-        s = get(monit["repos"][repo][stratum_name]["url"]).json()
-        pub_delta = (datetime.utcnow()-timestamp(s["stratum0"]["last_modified"])).total_seconds()
-        revdiff = s["stratum0"]["revision"]-s["stratum1"]["revision"]
-        ok = s["status"] == "ok"
-      except (RequestException,KeyError,ValueError) as e:
-        print("%s:%s: cannot get monitoring info: %s:%s" % (repo, stratum_name, type(e), e))
-        continue
-
-      if revdiff == 0:
-        print("%s:%s: OK" % (repo, stratum_name))
-      elif revdiff <= monit["max_revdelta"] and pub_delta <= monit["max_timedelta"]:
-        print("%s:%s: syncing: %d seconds, %d revisions behind (stratum0 updated %d seconds ago)" % \
-          (repo, stratum_name, pub_delta, revdiff, pub_delta))
-      else:
-        print("%s:%s: error: %d seconds, %d revisions behind (stratum0 updated %d seconds ago)" % \
-          (repo, stratum_name, pub_delta, revdiff, pub_delta))
-        if time.time()-monit["repos"][repo][stratum_name].get("last_notification", 0) > monit["snooze"]:
-          notify(monit["notif"],
-                 to=monit["repos"][repo][stratum_name]["contact"],
-                 stratum_name=stratum_name,
-                 repo=repo,
-                 api_url=monit["repos"][repo][stratum_name]["url"],
-                 delta_rev=revdiff,
-                 delta_time=pub_delta,
-                 stratum0_mod=s["stratum0"]["last_modified"],
-                 stratum1_mod=s["stratum1"]["last_modified"],
-                 stratum0_rev=s["stratum0"]["revision"],
-                 stratum1_rev=s["stratum1"]["revision"])
-          monit["repos"][repo][stratum_name]["last_notification"] = time.time()
+        results.append(r.get(max(0, deadline-time.time())))
+      except TimeoutError:
+        results.append((repo, stratum_name, None,
+                        TimeoutError("no answer within %d seconds" % monit["timeout"])))
+  finally:
+    pool.close()
+  return results
+
+def check(monit, history):
+  strata = [ (repo, stratum_name) for repo in monit["repos"] for stratum_name in monit["repos"][repo] ]
+  results = fetch_all(monit, strata)
+
+  now = time.time()
+  for repo,stratum_name,s,e in results:
+    if s is None:
+      print("%s:%s: cannot get monitoring info: %s:%s" % (repo, stratum_name, type(e), e))
+      continue
+    pub_delta = (datetime.utcnow()-timestamp(s["s0_mod"])).total_seconds()
+    revdiff = s["s0_rev"]-s["s1_rev"]
+
+    # Keep the last history_samples samples (time, stratum 0 revision, stratum 1 revision)
+    samples = history.setdefault("%s:%s" % (repo, stratum_name), [])
+    samples.append([ now, s["s0_rev"], s["s1_rev"] ])
+    del samples[:-monit["history_samples"]]
+
+    # Within the thresholds, the lag is fine whatever its trend: a stratum 1 keeping up with a
+    # busy stratum 0 is always a few revisions behind. Beyond them, alert unless the trend
+    # predicts the sync within max_sync_time
+    tr = trend(samples, monit["trend_samples"])
+    ok = revdiff <= monit["max_revdelta"] and pub_delta <= monit["max_timedelta"]
+    if tr is None:
+      eta_s = ""
+    else:
+      eta_s = ", %.2f revisions/h, %s" % \
+        (tr[0]*3600, "in sync in %d seconds" % tr[2] if tr[2] is not None else "lag not shrinking")
+      ok = ok or (tr[2] is not None and tr[2] <= monit["max_sync_time"])
+
+    if revdiff == 0:
+      print("%s:%s: OK" % (repo, stratum_name))
+    elif ok:
+      print("%s:%s: syncing: %d seconds, %d revisions behind (stratum0 updated %d seconds ago)%s" % \
+        (repo, stratum_name, pub_delta, revdiff, pub_delta, eta_s))
+    else:
+      print("%s:%s: error: %d seconds, %d revisions behind (stratum0 updated %d seconds ago)%s" % \
+        (repo, stratum_name, pub_delta, revdiff, pub_delta, eta_s))
+      if time.time()-monit["repos"][repo][stratum_name].get("last_notification", 0) > monit["snooze"]:
+        notify(monit["notif"],
+               to=monit["repos"][repo][stratum_name]["contact"],
+               stratum_name=stratum_name,
+               repo=repo,
+               api_url=monit["repos"][repo][stratum_name]["url"],
+               delta_rev=revdiff,
+               delta_time=pub_delta,
+               trend=eta_s.lstrip(", "),
+               stratum0_mod=s["s0_mod"],
+               stratum1_mod=s["s1_mod"],
+               stratum0_rev=s["s0_rev"],
+               stratum1_rev=s["s1_rev"])
+        monit["repos"][repo][stratum_name]["last_notification"] = time.time()
+
+  # Forget strata not monitored anymore
+  for k in list(history):
+    if not tuple(k.split(":", 1)) in strata:
+      del history[k]
+  if monit["history_file"]:
+    save_history(monit["history_file"], history)
 
 if __name__ == "__main__":
   try:
@@ -108,8 +200,15 @@ if __name__ == "__main__":
   monit["snooze"] = getint(monit, "snooze", 3600)
   monit["max_timedelta"] = getint(monit, "max_timedelta", 7200)
   monit["max_revdelta"] = getint(monit, "max_revdelta", 7200)
+  monit["timeout"] = getint(monit, "timeout", 30)
+  monit["parallel"] = getint(monit, "parallel", 8)
+  monit["history_samples"] = getint(monit, "history_samples", 96)
+  monit["trend_samples"] = getint(monit, "trend_samples", 4)
+  monit["max_sync_time"] = getint(monit, "max_sync_time", monit["max_timedelta"])
+  monit["history_file"] = monit.get("history_file", "cvmfs-mon-history.json")
 
+  history = load_history(monit["history_file"]) if monit["history_file"] else {}
   while True:
-    check(monit)
+    check(monit, history)
     print("sleeping %d seconds" % monit["sleep"])
     time.sleep(monit["sleep"])
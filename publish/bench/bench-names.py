@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# Compare the package name index of aliPublish with the former regexp scan over all package
+# names, on a synthetic tree. Usage: bench-names.py [--packages N] [--tarballs N]
+from __future__ import print_function
+from argparse import ArgumentParser
+from os.path import dirname, join, realpath
+from random import Random
+from re import search, escape
+from time import time
+import imp, sys
+
+sys.dont_write_bytecode = True
+
+aliPublish = imp.load_source("aliPublish", join(dirname(dirname(realpath(__file__))), "aliPublish"))
+
+def nameVerFromTarScan(tar, arch, validPacks):
+  # How aliPublish used to do it: one regexp per candidate package, longest names first
+  for pkgName in validPacks:
+    vm = search("^(%s)-(.*?)(\\.%s\\.tar\\.gz)?$" % (escape(pkgName), arch), tar)
+    if vm:
+      return { "name": vm.group(1), "ver": vm.group(2) }
+  return None
+
+def timed(f, tars):
+  t0 = time()
+  res = [ f(t) for t in tars ]
+  return time()-t0, res
+
+def main():
+  parser = ArgumentParser()
+  parser.add_argument("--packages", dest="packages", type=int, default=3000)
+  parser.add_argument("--tarballs", dest="tarballs", type=int, default=200)
+  parser.add_argument("--arch", dest="arch", default="el7-x86_64")
+  args = parser.parse_args()
+
+  rnd = Random(42)
+  # Package names with dashes, sharing prefixes with each other (e.g. Pkg-12 and Pkg-12-extra)
+  names = [ "Pkg-%d" % i for i in range(args.packages//2) ]
+  names += [ "%s-extra" % rnd.choice(names) for i in range(args.packages-len(names)) ]
+  names = sorted(set(names), key=lambda p: -len(p))
+  tars = [ "%s-v%d.%d-%d.%s.tar.gz" % (rnd.choice(names), rnd.randint(1, 9), rnd.randint(0, 99),
+                                      rnd.randint(1, 3), args.arch)
+           for _ in range(args.tarballs) ]
+
+  t0 = time()
+  index = aliPublish.PackageNames(names, args.arch)
+  tBuild = time()-t0
+  tIndex,resIndex = timed(index, tars)
+  tScan,resScan = timed(lambda t: nameVerFromTarScan(t, args.arch, names), tars)
+  assert resIndex == resScan, "results differ"
+
+  print("%d packages, %d tarball names" % (len(names), len(tars)))
+  print("regexp scan: %8.3f s (%10.0f names/s)" % (tScan, len(tars)/tScan))
+  print("index:       %8.3f s (%10.0f names/s), built in %.3f s" % (tIndex, len(tars)/tIndex, tBuild))
+  print("speedup:     %8.0fx" % (tScan/tIndex))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+# Run aliPublish against fake-tars.py at several scales, reporting wall time, time per phase,
+# HTTP requests (as counted by aliPublish and by the server) and peak memory of each run. For
+# each scale (<packages>x<versions>) the runs are:
+#   dry-run cold  sync-dir --dry-run with empty caches
+#   dry-run warm  the same again, with the listings cache and the snapshot of the previous run
+#   sync cold     sync-dir installing everything, with empty caches
+#   sync noop     sync-dir again, with nothing left to install
+# Usage: bench-sync.py [--scales 50x3,200x5] [--deps N] [--publish N] [--modes ...] [--json FILE]
+from __future__ import print_function
+from argparse import ArgumentParser
+from os.path import dirname, join, realpath
+from shutil import rmtree
+from subprocess import Popen, PIPE
+from tempfile import mkdtemp
+from time import time
+import json, os, sys
+
+try:
+  from urllib.request import urlopen
+except ImportError:
+  from urllib2 import urlopen
+
+BENCH_DIR = dirname(realpath(__file__))
+ALIPUBLISH = join(dirname(BENCH_DIR), "aliPublish")
+ARCH = "slc7_x86-64"
+MODES = [ "dry-run-cold", "dry-run-warm", "sync-cold", "sync-noop" ]
+
+def serverStats(baseUrl):
+  return json.loads(urlopen(baseUrl.rsplit("/TARS", 1)[0] + "/stats").read().decode("utf-8"))
+
+def startServer(python, packages, versions, deps, size):
+  # Start fake-tars.py on a free port, return the process and the base URL
+  proc = Popen([ python, join(BENCH_DIR, "fake-tars.py"), "--port", "0", "--arch", ARCH,
+                 "--packages", str(packages), "--versions", str(versions), "--deps", str(deps),
+                 "--size", str(size) ], stdout=PIPE)
+  line = proc.stdout.readline().decode("utf-8")
+  if not "http://" in line:
+    proc.kill()
+    raise RuntimeError("cannot start fake-tars.py: %s" % line)
+  return proc, line.split()[-1]
+
+def writeConf(workDir, baseUrl, packages, publish, installParallel):
+  # Publish all versions of the last publish packages (with dependencies), or everything
+  names = [ "Pkg%04d-tools" % (i-1) if i % 10 == 0 and i else "Pkg%04d" % i
+            for i in range(packages) ]
+  conf = [ "base_url: %s" % baseUrl,
+           "architectures:",
+           "  %s:" % ARCH,
+           "    dir: %s" % ARCH,
+           "package_dir: %s/%%(arch)s/Packages/%%(package)s/%%(version)s" % join(workDir, "sw"),
+           "modulefile: %s/%%(arch)s/Modules/modulefiles/%%(package)s/%%(version)s" %
+             join(workDir, "sw"),
+           "report_file: %s" % join(workDir, "report.json"),
+           "install_parallel: %d" % installParallel,
+           "conn_dethrottle_s: 0" ]
+  if publish:
+    conf += [ "filter_order: include,exclude", "include:" ]
+    conf += [ "  %s: true" % n for n in names[-publish:] ]
+  else:
+    conf += [ "filter_order: exclude,include" ]
+  path = join(workDir, "aliPublish.conf")
+  with open(path, "w") as f:
+    f.write("\n".join(conf) + "\n")
+  return path
+
+def runAliPublish(python, confFile, cacheDir, dryRun, logFile):
+  # Run aliPublish sync-dir, return exit code, wall time and peak resident memory (MB)
+  cmd = [ python, ALIPUBLISH, "sync-dir", "-c", confFile, "--cache-deps-dir", cacheDir,
+          "--no-notification" ] + ([ "--dry-run" ] if dryRun else [])
+  t0 = time()
+  with open(logFile, "w") as log:
+    proc = Popen(cmd, stdout=log, stderr=log)
+    # Reap it ourselves to get its own resource usage
+    _,status,usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.WEXITSTATUS(status)
+  return proc.returncode, time()-t0, usage.ru_maxrss/1024.
+
+def bench(args, packages, versions):
+  results = []
+  proc,baseUrl = startServer(args.python, packages, versions, args.deps, args.size)
+  workDir = mkdtemp(prefix="bench-sync-")
+  try:
+    confFile = writeConf(workDir, baseUrl, packages, args.publish, args.installParallel)
+    for mode in args.modes:
+      cacheDir = join(workDir, "cache-" + mode.split("-")[0])
+      if mode.endswith("-cold"):
+        rmtree(cacheDir, ignore_errors=True)
+        rmtree(join(workDir, "sw"), ignore_errors=True)
+        os.makedirs(cacheDir)
+      if os.path.exists(join(workDir, "report.json")):
+        os.remove(join(workDir, "report.json"))
+      before = serverStats(baseUrl)
+      rv,wall,rss = runAliPublish(args.python, confFile, cacheDir, mode.startswith("dry-run"),
+                                  join(workDir, mode + ".log"))
+      after = serverStats(baseUrl)
+      try:
+        report = json.load(open(join(workDir, "report.json")))
+      except (IOError, ValueError):
+        report = { "totals_s": {}, "counters": {}, "packages": [] }
+      results.append({ "scale": "%dx%d" % (packages, versions), "mode": mode, "exit_code": rv,
+                       "wall_s": wall, "peak_rss_mb": rss,
+                       "requests": report["counters"].get("requests"),
+                       "requests_cached": report["counters"].get("requests_cached"),
+                       "requests_revalidated": report["counters"].get("requests_revalidated"),
+                       "server_requests": after["requests"]-before["requests"],
+                       "server_mb": (after["bytes"]-before["bytes"])/1048576.,
+                       "installed": len([ p for p in report["packages"] if p["success"] ]),
+                       "phases_s": report["totals_s"] })
+      if rv != 0:
+        print("%s %s: aliPublish exited with %d, see %s" % (results[-1]["scale"], mode, rv,
+                                                           join(workDir, mode + ".log")))
+  finally:
+    proc.kill()
+    proc.wait()
+    if not args.keep:
+      rmtree(workDir, ignore_errors=True)
+    else:
+      print("Work directory kept: %s" % workDir)
+  return results
+
+def main():
+  parser = ArgumentParser()
+  parser.add_argument("--scales", dest="scales", default="50x3,200x5,500x5",
+                      help="Comma-separated <packages>x<versions> (default: 50x3,200x5,500x5)")
+  parser.add_argument("--deps", dest="deps", type=int, default=3,
+                      help="Direct dependencies per version (default: 3)")
+  parser.add_argument("--size", dest="size", type=int, default=4096,
+                      help="Payload bytes per tarball (default: 4096)")
+  parser.add_argument("--publish", dest="publish", type=int, default=10,
+                      help="Publish the last N packages with their dependencies, 0 for all "
+                           "(default: 10)")
+  parser.add_argument("--install-parallel", dest="installParallel", type=int, default=4)
+  parser.add_argument("--modes", dest="modes", default=",".join(MODES),
+                      help="Comma-separated runs among: " + ", ".join(MODES))
+  parser.add_argument("--python", dest="python", default=sys.executable,
+                      help="Python interpreter running aliPublish and fake-tars.py")
+  parser.add_argument("--json", dest="json", default=None, help="Also write results to this file")
+  parser.add_argument("--keep", dest="keep", action="store_true", default=False,
+                      help="Keep work directories (configuration, logs, installed packages)")
+  args = parser.parse_args()
+  args.modes = [ m for m in args.modes.split(",") if m ]
+  for m in args.modes:
+    if not m in MODES:
+      parser.error("unknown mode %s" % m)
+
+  results = []
+  print("%-10s %-13s %8s %8s %8s %8s %8s %8s %9s" % ("scale", "run", "wall s", "peak MB",
+                                                     "requests", "cached", "server", "srv MB",
+                                                     "installed"))
+  for scale in args.scales.split(","):
+    packages,versions = [ int(x) for x in scale.split("x") ]
+    for r in bench(args, packages, versions):
+      results.append(r)
+      print("%-10s %-13s %8.2f %8.1f %8s %8s %8d %8.1f %9d" %
+            (r["scale"], r["mode"], r["wall_s"], r["peak_rss_mb"], r["requests"],
+             (r["requests_cached"] or 0) + (r["requests_revalidated"] or 0),
+             r["server_requests"], r["server_mb"], r["installed"]))
+      sys.stdout.flush()
+  if args.json:
+    with open(args.json, "w") as f:
+      json.dump(results, f, indent=2, sort_keys=True)
+  sys.exit(0 if all(r["exit_code"] == 0 for r in results) else 1)
+
+if __name__ == "__main__":
+  main()
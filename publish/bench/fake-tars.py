@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+# Stand-in for the TARS server: serves the JSON directory listings (nginx autoindex format) of
+# dist, dist-direct and dist-runtime and the tarballs of a synthetic tree of packages, so that
+# aliPublish can be run and benchmarked locally. Listings have ETags and honour If-None-Match,
+# tarballs can be resumed with Range requests. GET /stats returns the number of requests and bytes
+# served. Usage: fake-tars.py [--port N] [--packages N] [--versions N] [--deps N] [--size BYTES]
+from __future__ import print_function
+from argparse import ArgumentParser
+from hashlib import md5
+from random import Random
+from threading import Lock
+from os import urandom
+import io, json, sys, tarfile
+
+try:
+  from http.server import HTTPServer, BaseHTTPRequestHandler
+  from socketserver import ThreadingMixIn
+except ImportError:
+  from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+  from SocketServer import ThreadingMixIn
+
+MTIME = "Mon, 01 Jan 2018 00:00:00 GMT"
+
+class SyntheticTree(object):
+  # Packages depend on packages created before them, each dependency on a random version. A
+  # fraction (runtime) of the direct dependencies are runtime dependencies as well. Every tenth
+  # package name extends the previous one with a dash (e.g. Pkg0009 and Pkg0009-tools), as real
+  # names do, to exercise the splitting of tarball names. Tarballs are generated on first use
+  def __init__(self, archs, packages, versions, deps, size, runtime=0.7, seed=42):
+    rnd = Random(seed)
+    self.archs    = archs
+    self.size     = size
+    self.names    = [ "Pkg%04d-tools" % (i-1) if i % 10 == 0 and i else "Pkg%04d" % i
+                      for i in range(packages) ]
+    self.versions = dict((p, [ "v1.%d-1" % j for j in range(versions) ]) for p in self.names)
+    self.direct   = {}
+    self.runtime  = {}
+    for i,p in enumerate(self.names):
+      for v in self.versions[p]:
+        direct = [ (q, rnd.choice(self.versions[q]))
+                   for q in rnd.sample(self.names[:i], min(deps, i)) ]
+        self.direct[(p,v)] = direct
+        self.runtime[(p,v)] = [ d for d in direct if rnd.random() < runtime ]
+    self.files    = dict(((arch, self.tarName(arch, (p,v))), (p,v))
+                         for arch in archs for p in self.names for v in self.versions[p])
+    self.closures = {}
+    self.tarballs = {}
+    self.lock     = Lock()
+
+  def closure(self, edges, node):
+    key = (id(edges), node)
+    if not key in self.closures:
+      seen = set([ node ])
+      todo = [ node ]
+      while todo:
+        for d in edges[todo.pop()]:
+          if not d in seen:
+            seen.add(d)
+            todo.append(d)
+      self.closures[key] = sorted(seen)
+    return self.closures[key]
+
+  def deps(self, kind, node):
+    if kind == "dist-direct":
+      return [ node ] + self.direct[node]
+    return self.closure(self.runtime if kind == "dist-runtime" else self.direct, node)
+
+  def tarball(self, arch, node):
+    # Same layout as the real ones: ./<arch>/<package>/<version>/...
+    with self.lock:
+      if (arch, node) in self.tarballs:
+        return self.tarballs[(arch, node)]
+    pkg,ver = node
+    base = "./%s/%s/%s/" % (arch, pkg, ver)
+    buf = io.BytesIO()
+    tar = tarfile.open(fileobj=buf, mode="w:gz")
+    def add(name, data, mode=0o644):
+      info = tarfile.TarInfo(base + name)
+      info.size = len(data)
+      info.mode = mode
+      tar.addfile(info, io.BytesIO(data))
+    add("relocate-me.sh", b"#!/bin/sh\necho relocating $PKGPATH\n", 0o755)
+    add("etc/modulefiles/" + pkg, b"#%Module\n")
+    add("bin/tool", urandom(self.size), 0o755)
+    link = tarfile.TarInfo(base + "bin/tool-link")
+    link.type = tarfile.LNKTYPE
+    link.linkname = base + "bin/tool"
+    tar.addfile(link)
+    tar.close()
+    with self.lock:
+      self.tarballs[(arch, node)] = buf.getvalue()
+    return buf.getvalue()
+
+  def tarName(self, arch, node):
+    return "%s-%s.%s.tar.gz" % (node[0], node[1], arch)
+
+  def listing(self, arch, kind, parts):
+    # JSON listing for /TARS/<arch>/<kind>/[<package>/[<package>-<version>/]], None if not found
+    if not parts:
+      return [ { "name": p, "type": "directory", "mtime": MTIME } for p in self.names ]
+    pkg = parts[0]
+    if not pkg in self.versions:
+      return None
+    if len(parts) == 1:
+      return [ { "name": "%s-%s" % (pkg, v), "type": "directory", "mtime": MTIME }
+               for v in self.versions[pkg] ]
+    ver = parts[1][len(pkg)+1:]
+    if not parts[1].startswith(pkg+"-") or not ver in self.versions[pkg]:
+      return None
+    return [ { "name": self.tarName(arch, d), "type": "file", "mtime": MTIME,
+               "size": len(self.tarball(arch, d)) }
+             for d in self.deps(kind, (pkg, ver)) ]
+
+  def resolve(self, arch, name):
+    # Package and version of a tarball name, or None
+    return self.files.get((arch, name))
+
+class TarsHandler(BaseHTTPRequestHandler):
+  protocol_version = "HTTP/1.1"
+
+  def log_message(self, fmt, *args):
+    pass
+
+  def reply(self, code, body, ctype="application/json", etag=None, headers=None):
+    with self.server.lock:
+      self.server.stats["requests"] += 1
+      self.server.stats["bytes"] += len(body)
+      self.server.stats["status"][str(code)] = self.server.stats["status"].get(str(code), 0) + 1
+    self.send_response(code)
+    self.send_header("Content-Type", ctype)
+    self.send_header("Content-Length", str(len(body)))
+    if etag:
+      self.send_header("ETag", etag)
+    for k,v in (headers or {}).items():
+      self.send_header(k, v)
+    self.end_headers()
+    self.wfile.write(body)
+
+  def do_GET(self):
+    tree = self.server.tree
+    parts = [ x for x in self.path.split("?")[0].split("/") if x ]
+    if parts == [ "stats" ]:
+      with self.server.lock:
+        stats = json.dumps(self.server.stats).encode("utf-8")
+      return self.reply(200, stats)
+    if len(parts) < 3 or parts[0] != "TARS" or not parts[1] in tree.archs or \
+       not parts[2] in [ "dist", "dist-direct", "dist-runtime" ]:
+      return self.reply(404, b"{}")
+    arch,kind,parts = parts[1],parts[2],parts[3:]
+    if len(parts) == 3:
+      node = tree.resolve(arch, parts[2])
+      if not node:
+        return self.reply(404, b"{}")
+      data = tree.tarball(arch, node)
+      start = 0
+      rng = self.headers.get("Range", "")
+      if rng.startswith("bytes=") and rng[6:].rstrip("-").isdigit():
+        start = int(rng[6:].rstrip("-"))
+        return self.reply(206, data[start:], "application/octet-stream", headers={
+          "Content-Range": "bytes %d-%d/%d" % (start, len(data)-1, len(data)) })
+      return self.reply(200, data, "application/octet-stream")
+    listing = tree.listing(arch, kind, parts)
+    if listing is None:
+      return self.reply(404, b"{}")
+    body = json.dumps(listing).encode("utf-8")
+    etag = '"%s"' % md5(body).hexdigest()
+    if self.headers.get("If-None-Match") == etag:
+      return self.reply(304, b"", etag=etag)
+    self.reply(200, body, etag=etag)
+
+class TarsServer(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+
+def main():
+  parser = ArgumentParser()
+  parser.add_argument("--port", dest="port", type=int, default=8765)
+  parser.add_argument("--bind", dest="bind", default="127.0.0.1")
+  parser.add_argument("--arch", dest="archs", action="append", default=[],
+                      help="Architecture to serve, can be repeated (default: slc7_x86-64)")
+  parser.add_argument("--packages", dest="packages", type=int, default=100)
+  parser.add_argument("--versions", dest="versions", type=int, default=5,
+                      help="Versions per package")
+  parser.add_argument("--deps", dest="deps", type=int, default=3,
+                      help="Direct dependencies per version")
+  parser.add_argument("--size", dest="size", type=int, default=4096,
+                      help="Payload bytes per tarball (incompressible)")
+  parser.add_argument("--seed", dest="seed", type=int, default=42)
+  args = parser.parse_args()
+
+  server = TarsServer((args.bind, args.port), TarsHandler)
+  server.tree  = SyntheticTree(args.archs or [ "slc7_x86-64" ], args.packages, args.versions,
+                               args.deps, args.size, seed=args.seed)
+  server.lock  = Lock()
+  server.stats = { "requests": 0, "bytes": 0, "status": {} }
+  print("Serving %d package(s) x %d version(s) on http://%s:%d/TARS" %
+        (args.packages, args.versions, args.bind, server.server_address[1]))
+  sys.stdout.flush()
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+
+if __name__ == "__main__":
+  main()
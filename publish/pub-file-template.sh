@@ -1,20 +1,9 @@
 #!/bin/bash -ex
 set -o pipefail
 PACKAGES_DIR="$(dirname "$(dirname "%(pkgdir)s")")"
-mkdir -p "$PACKAGES_DIR"
 cd "$PACKAGES_DIR"
-SSLVERIFY=%(http_ssl_verify)d
-CONNTIMEOUT=%(conn_timeout_s)d
-CONNRETRY=%(conn_retries)d
-CONNRETRYDELAY=%(conn_dethrottle_s)d
-[[ $SSLVERIFY == 0 ]] && SSLVERIFY=-k || SSLVERIFY=
-curl -Lsf $SSLVERIFY                \
-     --connect-timeout $CONNTIMEOUT \
-     --retry-delay $CONNRETRYDELAY  \
-     --retry $CONNRETRY "%(url)s"   | tar --strip-components=2 -xzf -
-# Dereference hardlinks: CVMFS does not support them across dirs
-find "%(pkgdir)s" -not -type d -links +1 -exec \
-  sh -ec 'cp -ip "{}" "{}".__DEREF__; mv "{}".__DEREF__ "{}"' \;
+# %(url)s was already downloaded, verified and unpacked (hardlinks dereferenced) by aliPublish
+[[ -d "%(pkgdir)s" ]]
 export WORK_DIR="$PWD"
 export PKGPATH="%(package)s/%(version)s"
 sh -e "%(pkgdir)s/relocate-me.sh"
@@ -0,0 +1,7 @@
+import imp
+from os.path import dirname, join, realpath
+
+# publish/aliPublish has no .py extension: load it once for all the tests
+ALIPUBLISH = join(dirname(dirname(realpath(__file__))), "publish", "aliPublish")
+aliPublish = imp.new_module("aliPublish")
+exec(compile(open(ALIPUBLISH).read(), ALIPUBLISH, "exec"), aliPublish.__dict__)
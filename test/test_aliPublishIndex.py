@@ -0,0 +1,82 @@
+import unittest
+from os import makedirs
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from test.aliPublishModule import aliPublish
+
+class TestInstalledIndex(unittest.TestCase):
+  # Nothing is unpacked: only the index changes
+  def setUp(self):
+    self.tmp = mkdtemp()
+    self.realExecute = aliPublish.execute
+    makedirs(join(self.tmp, "arch", "Packages", "A", "1"))
+    self.args = (join(self.tmp, "%(arch)s/Modules/modulefiles/%(package)s/%(version)s"),
+                 join(self.tmp, "%(arch)s/Packages/%(package)s/%(version)s"),
+                 "true", { "http_ssl_verify": False })
+
+  def tearDown(self):
+    aliPublish.execute = self.realExecute
+    rmtree(self.tmp)
+
+  def test_plain(self):
+    pub = aliPublish.PlainFilesystem(*self.args, dryRun=True)
+    self.assertTrue(pub.installed("arch", "A", "1"))
+    self.assertFalse(pub.installed("arch", "A", "2"))
+    self.assertEqual(pub.install("url", "arch", "A", "2", [], []), 0)
+    self.assertFalse(pub.installed("arch", "A", "2"))
+    pub.publish()
+    self.assertTrue(pub.installed("arch", "A", "2"))
+
+  def test_plainAbort(self):
+    pub = aliPublish.PlainFilesystem(*self.args, dryRun=True)
+    self.assertFalse(pub.installed("arch", "A", "2"))
+    pub.install("url", "arch", "A", "2", [], [])
+    pub.abort()
+    pub.publish()
+    self.assertFalse(pub.installed("arch", "A", "2"))
+
+  def test_cvmfs(self):
+    pub = aliPublish.CvmfsServer("repo", *self.args, dryRun=True)
+    self.assertFalse(pub.installed("arch", "A", "2"))
+    self.assertTrue(pub.transaction())
+    pub.install("url", "arch", "A", "2", [], [])
+    self.assertTrue(pub.abort())
+    self.assertFalse(pub.installed("arch", "A", "2"))
+    self.assertTrue(pub.transaction())
+    pub.install("url", "arch", "A", "2", [], [])
+    self.assertFalse(pub.installed("arch", "A", "2"))
+    self.assertTrue(pub.publish())
+    self.assertTrue(pub.installed("arch", "A", "2"))
+
+  def cvmfs(self, results):
+    # Not a dry run: cvmfs_server commands return the given results, nothing is unpacked and
+    # the publish script succeeds
+    commands = []
+    def execute(command):
+      if not isinstance(command, list):
+        return 0
+      commands.append(command[1])
+      return results.get(command[1], 0)
+    aliPublish.execute = execute
+    pub = aliPublish.CvmfsServer("repo", *self.args)
+    pub._unpack = lambda kw, tarball: 0
+    self.assertTrue(pub.installed("arch", "A", "1"))
+    self.assertTrue(pub.transaction())
+    self.assertEqual(pub.install("url", "arch", "A", "2", [], []), 0)
+    return pub,commands
+
+  def test_cvmfsPublishFails(self):
+    pub,commands = self.cvmfs({ "publish": 1 })
+    self.assertFalse(pub.publish())
+    self.assertEqual(commands, [ "transaction", "publish", "abort" ])
+    self.assertEqual(pub._installed, {})
+    self.assertFalse(pub.installed("arch", "A", "2"))
+
+  def test_cvmfsAbortFails(self):
+    pub,commands = self.cvmfs({ "abort": 1 })
+    self.assertFalse(pub.abort())
+    self.assertEqual((pub._installed, pub._pending), ({}, {}))
+
+if __name__ == '__main__':
+  unittest.main()
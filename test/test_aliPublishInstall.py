@@ -0,0 +1,148 @@
+import unittest
+from threading import Lock
+from time import sleep
+from test.aliPublishModule import aliPublish
+
+def job(key, *waitFor):
+  return { "key": key, "waitFor": set(waitFor) }
+
+class TestInstallOrdered(unittest.TestCase):
+  def run_jobs(self, jobs, workers, fail=(), sleep_s=0):
+    self.started = []
+    self.done = {}
+    self.running = 0
+    self.maxRunning = 0
+    lock = Lock()
+    def install(j):
+      with lock:
+        self.started.append(j["key"])
+        self.running += 1
+        self.maxRunning = max(self.maxRunning, self.running)
+      sleep(sleep_s)
+      with lock:
+        self.running -= 1
+      if j["key"] == "boom":
+        raise RuntimeError("boom")
+      return 1 if j["key"] in fail else 0
+    def done(j, rv):
+      self.assertFalse(j["key"] in self.done)
+      self.done[j["key"]] = rv
+    aliPublish.installOrdered(jobs, workers, install, done)
+
+  def test_order(self):
+    for workers in [ 1, 4 ]:
+      self.run_jobs([ job("c", "b"), job("b", "a"), job("a"), job("d", "a", "c") ], workers)
+      self.assertEqual(self.started, [ "a", "b", "c", "d" ])
+      self.assertEqual(self.done, { "a": 0, "b": 0, "c": 0, "d": 0 })
+
+  def test_failurePropagates(self):
+    self.run_jobs([ job("a"), job("b", "a"), job("c", "b"), job("d"), job("e", "d") ], 2,
+                  fail=[ "b" ])
+    self.assertEqual(sorted(self.started), [ "a", "b", "d", "e" ])
+    self.assertEqual(self.done, { "a": 0, "b": 1, "c": None, "d": 0, "e": 0 })
+
+  def test_exception(self):
+    self.run_jobs([ job("boom"), job("after", "boom") ], 2)
+    self.assertEqual(self.done, { "boom": -1, "after": None })
+
+  def test_unknownAndSelf(self):
+    # Waiting for jobs not in the list, or for itself, does not block
+    self.run_jobs([ job("a", "a", "missing") ], 1)
+    self.assertEqual(self.done, { "a": 0 })
+
+  def test_circular(self):
+    self.run_jobs([ job("a", "b"), job("b", "a"), job("c") ], 2)
+    self.assertEqual(self.started, [ "c" ])
+    self.assertEqual(self.done, { "a": None, "b": None, "c": 0 })
+
+  def test_workers(self):
+    self.run_jobs([ job(str(i)) for i in range(6) ], 2, sleep_s=0.05)
+    self.assertEqual(self.maxRunning, 2)
+    self.assertEqual(len(self.done), 6)
+
+class JGet(object):
+  # Returns the listing registered for each URL, or None
+  def __init__(self, listings):
+    self.listings = listings
+  def many(self, urls):
+    return [ self.listings.get(u) for u in urls ]
+
+def tar(name, ver, size=1):
+  return { "name": "%s-%s.arch.tar.gz" % (name, ver), "type": "file", "size": size }
+
+class TestPackageGraph(unittest.TestCase):
+  def setUp(self):
+    self.graph = aliPublish.PackageGraph("arch", aliPublish.PackageNames([ "A", "B", "C", "C-foo" ],
+                                                                        "arch"))
+
+  def test_deps(self):
+    g = self.graph
+    g.setDeps("dist-direct", ("A", "1"), [ ("A", "1"), ("A", "2"), ("B", "1"), ("C", "1") ])
+    g.setDeps("dist-runtime", ("A", "1"), [ ("B", "1") ])
+    self.assertEqual(g.deps("dist-direct", ("A", "1")), set([ ("B", "1"), ("C", "1") ]))
+    self.assertEqual(len(g), 3)
+    self.assertTrue(("C", "1") in g)
+    self.assertTrue(g.hasDeps("dist-direct", ("A", "1")))
+    self.assertFalse(g.hasDeps("dist", ("A", "1")))
+    self.assertEqual(g.deps("dist", ("A", "1")), set())
+    self.assertEqual(g.directRuntime(("A", "1")), set([ ("B", "1") ]))
+    self.assertEqual(g.dependents("dist-direct", ("B", "1")), set([ ("A", "1") ]))
+    self.assertEqual(g.dump([ ("A", "1") ])["packages"][0]["dist-direct-runtime"],
+                     [ { "name": "B", "ver": "1" } ])
+
+  def test_parse(self):
+    # The longest package name wins
+    nodes = self.graph.parse([ tar("C-foo", "1"), tar("C", "foo-2"), tar("C", "3"), tar("D", "1"),
+                               { "name": "A-1", "type": "directory" } ])
+    self.assertEqual(nodes, [ ("C-foo", "1"), ("C-foo", "2"), ("C", "3") ])
+
+  def test_fetchDeps(self):
+    g = self.graph
+    url = lambda kind: aliPublish.format(aliPublish.depUrlTpls[kind], baseUrl="http://tars",
+                                         arch="arch", pack="A", ver="1")
+    listings = { url("dist"): [ tar("A", "1"), tar("B", "1"), tar("C", "1") ],
+                 url("dist-direct"): [ tar("A", "1", size=42), tar("B", "1") ] }
+    failed = g.fetchDeps([ ("A", "1") ], "http://tars", JGet(listings))
+    self.assertEqual(failed, { ("A", "1"): "dist-runtime" })
+    self.assertEqual(g.deps("dist", ("A", "1")), set([ ("B", "1"), ("C", "1") ]))
+    self.assertEqual(g.tarballs[("A", "1")]["size"], 42)
+    # Listed dependencies are not fetched again
+    failed = g.fetchDeps([ ("A", "1") ], "http://tars", JGet({ url("dist-runtime"): [ tar("A", "1") ] }))
+    self.assertEqual(failed, {})
+    self.assertTrue(g.hasDeps("dist-runtime", ("A", "1")))
+
+class Publisher(object):
+  # Nothing is installed, and transactions cannot be opened
+  def installed(self, arch, pkgName, pkgVer):
+    return False
+  def transaction(self):
+    return False
+
+class TestSync(unittest.TestCase):
+  def test_noTransaction(self):
+    # Not fatal for the caller: serve keeps running
+    g = aliPublish.PackageGraph("arch", aliPublish.PackageNames([ "A" ], "arch"))
+    listings = dict((aliPublish.format(aliPublish.depUrlTpls[kind], baseUrl="http://tars",
+                                       arch="arch", pack="A", ver="1"), [ tar("A", "1") ])
+                    for kind in aliPublish.depUrlTpls)
+    self.assertRaises(aliPublish.PublishException, aliPublish.sync,
+                      pub=Publisher(), architectures={ "arch": "arch" }, baseUrl="http://tars",
+                      rules={}, includeFirst=True, autoIncludeDeps=False, notifEmail={},
+                      riemann=None, dryRun=True, jget=JGet(listings),
+                      crawled=({ "arch": g }, { "arch": [ ("A", "1") ] }))
+
+class TestJGet(unittest.TestCase):
+  def test_close(self):
+    class Get(aliPublish.JGet):
+      def __call__(self, url):
+        return url.upper()
+    jget = Get(http_ssl_verify=False, conn_timeout_s=1, conn_retries=0, conn_dethrottle_s=0,
+               cache_dir=None, conn_parallel=3)
+    self.assertEqual(jget.many([ "a", "b", "c" ]), [ "A", "B", "C" ])
+    workers = jget.pool._pool
+    jget.close()
+    self.assertIsNone(jget.pool)
+    self.assertFalse(any(w.is_alive() for w in workers))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,42 @@
+import unittest
+from argparse import Namespace
+from os.path import dirname
+from test.aliPublishModule import aliPublish, ALIPUBLISH
+
+ARGS = Namespace(dryRun=True, notify=False, abort=False, cacheDepsDir=None)
+
+def config(**publishers):
+  return { "base_url": "http://tars", "architectures": { "arch": { "dir": "arch" } },
+           "package_dir": "/tmp/%(arch)s/%(package)s/%(version)s",
+           "modulefile": "/tmp/%(arch)s/modulefiles/%(package)s/%(version)s",
+           "include": { "A": True }, "exclude": {}, "auto_include_deps": False,
+           "notification_email": {}, "install_parallel": 1, "publishers": publishers }
+
+class TestSyncMulti(unittest.TestCase):
+  def publishers(self, conf):
+    return aliPublish.makePublishers(conf, ARGS, {}, dirname(ALIPUBLISH))
+
+  def test_installParallel(self):
+    conf = config(one={ "action": "sync-dir" }, two={ "action": "sync-dir", "install_parallel": 4 })
+    publishers = self.publishers(conf)
+    self.assertEqual([ p["conf"]["install_parallel"] for p in publishers ], [ 1, 4 ])
+    # Each sync runs with the setting of its publisher
+    calls = []
+    real = dict((f, getattr(aliPublish, f)) for f in [ "crawlAll", "sync", "finishReport" ])
+    aliPublish.crawlAll = lambda baseUrl, sels, *a: ({}, [ {} for s in sels ])
+    aliPublish.sync = lambda **kw: calls.append(kw["installParallel"]) or True
+    aliPublish.finishReport = lambda *a: None
+    try:
+      aliPublish.runSyncMulti(ARGS, conf, publishers, None, None, None)
+    finally:
+      for f,fn in real.items():
+        setattr(aliPublish, f, fn)
+    self.assertEqual(calls, [ 1, 4 ])
+
+  def test_invalid(self):
+    for value in [ 0, "4", None ]:
+      conf = config(one={ "action": "sync-dir", "install_parallel": value })
+      self.assertIsNone(self.publishers(conf))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,117 @@
+import sys, unittest
+from threading import Event
+from test.aliPublishModule import aliPublish
+
+class TestBackgroundQueue(unittest.TestCase):
+  def test_batches(self):
+    batches = []
+    go = Event()
+    def deliver(batch):
+      go.wait(5)
+      batches.append(list(batch))
+      return True
+    q = aliPublish.BackgroundQueue("test", deliver, batchSize=3, interval_s=0.2)
+    for i in range(7):
+      q.put(i)
+    go.set()
+    q.close(timeout_s=5)
+    self.assertFalse(q.thread.is_alive())
+    self.assertEqual(sum(batches, []), range(7))
+    self.assertTrue(max(len(b) for b in batches) <= 3)
+
+  def test_interval(self):
+    # A partial batch is delivered after interval_s, without waiting for it to fill up
+    delivered = Event()
+    q = aliPublish.BackgroundQueue("test", lambda b: delivered.set() or True, interval_s=0.05)
+    q.put(1)
+    self.assertTrue(delivered.wait(5))
+    q.close(timeout_s=5)
+
+  def test_retries(self):
+    attempts = []
+    def deliver(batch):
+      attempts.append(list(batch))
+      if len(attempts) == 1:
+        raise IOError("connection refused")
+      return len(attempts) > 2
+    q = aliPublish.BackgroundQueue("test", deliver, interval_s=0, retries=3, backoff_s=0.01)
+    q.put("a")
+    q.close(timeout_s=5)
+    self.assertEqual(attempts, [ [ "a" ] ] * 3)
+
+  def test_dropped(self):
+    attempts = []
+    def deliver(batch):
+      attempts.append(list(batch))
+      return bool(batch[0] == "b")
+    q = aliPublish.BackgroundQueue("test", deliver, interval_s=0, retries=2, backoff_s=0.01)
+    q.put("a")
+    q.close(timeout_s=0)  # does not wait
+    q.put("b")
+    q.thread.join(5)
+    # "a" is dropped after retries, "b" was queued after closing and is not delivered
+    self.assertEqual(attempts, [ [ "a" ] ] * 3)
+
+class SMTP(object):
+  # Fails for one recipient, once
+  sent = []
+  failing = set()
+  def __init__(self, server, port):
+    pass
+  def sendmail(self, sender, to, body):
+    if to[0] in SMTP.failing:
+      SMTP.failing.discard(to[0])
+      raise IOError("try again later")
+    SMTP.sent.append((sender, to[0], body))
+  def quit(self):
+    pass
+
+class TestEmailDigests(unittest.TestCase):
+  def setUp(self):
+    self.realSMTP = aliPublish.SMTP
+    aliPublish.SMTP = SMTP
+    SMTP.sent = []
+
+  def tearDown(self):
+    aliPublish.SMTP = self.realSMTP
+
+  def test_digests(self):
+    SMTP.failing = set([ "bob@cern.ch" ])
+    d = aliPublish.EmailDigests({ "server": "localhost" }, dryRun=False)
+    d._queue.backoff_s = 0.01
+    d.add("bot@cern.ch", [ "alice@cern.ch", "bob@cern.ch" ], "A 1 published", "A")
+    d.add("bot@cern.ch", [ "alice@cern.ch" ], "B 1 published", "B")
+    d.close()
+    self.assertEqual(sorted(to for _,to,_ in SMTP.sent), [ "alice@cern.ch", "bob@cern.ch" ])
+    alice = [ b for _,to,b in SMTP.sent if to == "alice@cern.ch" ][0]
+    self.assertTrue(alice.startswith("Subject: A 1 published (+1 more)\n"))
+    self.assertTrue("=== B 1 published ===" in alice)
+
+class Bernhard(object):
+  # Stands for the bernhard module
+  sent = []
+  class Client(object):
+    def __init__(self, host, port):
+      pass
+    def send(self, *events):
+      Bernhard.sent.append(events)
+      return True
+
+class TestRiemann(unittest.TestCase):
+  def test_batched(self):
+    sys.modules["bernhard"] = Bernhard
+    try:
+      r = aliPublish.RiemannPkgNotify("localhost", 5555)
+      for i in range(10):
+        r.notify("ok", "arch", "A", str(i))
+      r.metric("run/packages", 10)
+      r.close()
+    finally:
+      del sys.modules["bernhard"]
+    events = sum([ list(x) for x in Bernhard.sent ], [])
+    self.assertEqual(len(events), 12)
+    self.assertTrue(len(Bernhard.sent) < 12)
+    self.assertEqual(events[-1]["service"], "aliPublish run/packages")
+
+if __name__ == '__main__':
+  unittest.main()
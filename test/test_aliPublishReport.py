@@ -0,0 +1,59 @@
+import json, unittest
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from test.aliPublishModule import aliPublish
+
+class Riemann(object):
+  def __init__(self):
+    self.metrics = {}
+  def metric(self, service, value):
+    self.metrics[service] = value
+
+class Response(object):
+  def raise_for_status(self):
+    pass
+
+class TestRunReport(unittest.TestCase):
+  def setUp(self):
+    self.report = aliPublish.RunReport()
+    self.report.add("crawl", "arch", self.report.start)
+    self.report.add("crawl", "arch2", self.report.start)
+    self.report.package("arch", "A", "1", 1., 1000, 0)
+    self.report.package("arch", "B", "1", 1., 10, 0, estimated=True)
+    self.report.package("arch", "C", "1", 0., None, None, estimated=True)
+
+  def test_dump(self):
+    tmp = mkdtemp()
+    try:
+      self.report.write(join(tmp, "report.json"))
+      dump = json.loads(open(join(tmp, "report.json")).read())
+    finally:
+      rmtree(tmp)
+    self.assertEqual((dump["bytes"], dump["bytes_estimated"]), (1000, 10))
+    self.assertEqual(dump["totals_s"].keys(), [ "crawl" ])
+    self.assertEqual([ p["bytes_estimated"] for p in dump["packages"] ], [ False, True, True ])
+    self.assertEqual([ p["started"] for p in dump["packages"] ], [ True, True, False ])
+
+  def test_riemann(self):
+    r = Riemann()
+    self.report.riemann(r)
+    self.assertEqual((r.metrics["run bytes"], r.metrics["run bytes estimated"]), (1000, 10))
+    self.assertTrue("phase crawl" in r.metrics)
+
+  def test_influxdb(self):
+    posted = []
+    realPost = aliPublish.requests.post
+    aliPublish.requests.post = lambda url, data, timeout: posted.append(data) or Response()
+    try:
+      self.report.influxdb("http://influxdb/write", 1)
+    finally:
+      aliPublish.requests.post = realPost
+    lines = posted[0].split("\n")
+    self.assertEqual(len(lines), 6)
+    self.assertTrue(",package=B," in lines[3] and ",bytes_estimated=true," in lines[3])
+    self.assertTrue(lines[-1].startswith("aliPublish_run "))
+    self.assertTrue(",bytes=1000i,bytes_estimated=10i " in lines[-1])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+from test.aliPublishModule import aliPublish
+
+RuleMatcher = aliPublish.RuleMatcher
+
+class TestRuleMatcher(unittest.TestCase):
+  def test_booleans(self):
+    self.assertTrue(RuleMatcher(True)("v1"))
+    self.assertFalse(RuleMatcher(False)("v1"))
+    self.assertFalse(RuleMatcher([])("v1"))
+
+  def test_alternation(self):
+    m = RuleMatcher([ "^v5-08-", "^vAN-2018(01|02)", "-test$" ])
+    self.assertEqual(len(m.regexps), 1)
+    for name in [ "v5-08-00-1", "vAN-20180102-1", "v1-test" ]:
+      self.assertTrue(m(name))
+    for name in [ "v5-09-00-1", "vAN-20180302-1", "v1-test-1" ]:
+      self.assertFalse(m(name))
+
+  def test_manyGroups(self):
+    exprs = [ "^(v)(%d)$" % i for i in range(200) ]
+    m = RuleMatcher(exprs)
+    self.assertEqual(len(m.regexps), 5)
+    self.assertTrue(m("v0"))
+    self.assertTrue(m("v199"))
+    self.assertFalse(m("v200"))
+
+  def test_backreference(self):
+    # Groups of the other regexps would shift \1 and (?(1)...)
+    for e in [ r"^(a)x\1$", r"^(?P<p>a)x(?P=p)$", r"^(a)?x(?(1)a|b)$" ]:
+      m = RuleMatcher([ "^(z)", e ])
+      self.assertEqual(len(m.regexps), 2, e)
+      self.assertTrue(m("axa"), e)
+      self.assertFalse(m("axz"), e)
+
+  def test_flags(self):
+    # The flag applies to that regexp only
+    m = RuleMatcher([ "^v1$", "(?i)^test$" ])
+    self.assertEqual(len(m.regexps), 2)
+    self.assertTrue(m("TEST"))
+    self.assertFalse(m("V1"))
+
+  def test_namedGroups(self):
+    m = RuleMatcher([ "^(?P<ver>v1)$", "^(?P<ver>v2)$", "^(?:v3|(?=v4))" ])
+    self.assertEqual(len(m.regexps), 3)
+    for name in [ "v1", "v2", "v3", "v4" ]:
+      self.assertTrue(m(name))
+    self.assertFalse(m("v5"))
+
+class TestRuleSet(unittest.TestCase):
+  def test_rules(self):
+    rules = { "include": { "arch": { "A": [ "^v1" ], "B": True } },
+              "exclude": { "arch": { "A": [ "-rc$" ] } } }
+    for includeFirst in [ True, False ]:
+      r = aliPublish.RuleSet(rules, includeFirst)
+      self.assertTrue(r("arch", "A", "v1-1"))
+      self.assertFalse(r("arch", "A", "v1-rc"))
+      self.assertFalse(r("arch", "A", "v2"))
+      self.assertTrue(r("arch", "B", "v2"))
+      self.assertEqual(r("arch", "C", "v1"), not includeFirst)
+
+if __name__ == '__main__':
+  unittest.main()
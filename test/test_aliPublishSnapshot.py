@@ -0,0 +1,73 @@
+import json, unittest
+from os import listdir
+from os.path import join
+from shutil import rmtree
+from tempfile import mkdtemp
+from test.aliPublishModule import aliPublish
+
+def graph():
+  g = aliPublish.PackageGraph("slc7/x86_64")
+  g.setDeps("dist-runtime", ("A", "1"), [ ("B", "1") ])
+  g.setDeps("dist-runtime", ("A", "2"), [ ("B", "1") ])
+  g.setDeps("dist-direct", ("A", "1"), [ ("B", "1") ])
+  g.tarballs[("A", "1")] = { "name": "A-1.slc7_x86-64.tar.gz", "size": 42 }
+  return g
+
+class TestRemoteSnapshot(unittest.TestCase):
+  def setUp(self):
+    self.tmp = mkdtemp()
+
+  def tearDown(self):
+    rmtree(self.tmp)
+
+  def test_versions(self):
+    s = aliPublish.RemoteSnapshot(None, "http://tars", "slc7/x86_64")
+    self.assertIsNone(s.versions("A", "mtime1"))
+    s.setVersions("A", "mtime1", [ "1", "2" ])
+    self.assertEqual(s.versions("A", "mtime1"), [ "1", "2" ])
+    # Directory changed, or no modification time known: list again
+    self.assertIsNone(s.versions("A", "mtime2"))
+    self.assertIsNone(s.versions("A", None))
+
+  def test_inMemory(self):
+    s = aliPublish.RemoteSnapshot(None, "http://tars", "slc7/x86_64")
+    s.setVersions("A", "mtime1", [ "1" ])
+    s.save(graph())
+    # Version 2 of A is gone, B was not listed and is kept
+    self.assertEqual(sorted(s.deps["dist-runtime"]), [ ("A", "1") ])
+    g = aliPublish.PackageGraph("slc7/x86_64")
+    s.restore(g)
+    self.assertEqual(g.deps("dist-runtime", ("A", "1")), set([ ("B", "1") ]))
+    self.assertFalse(g.hasDeps("dist-runtime", ("A", "2")))
+    self.assertEqual(g.tarballs[("A", "1")]["size"], 42)
+    self.assertEqual(listdir(self.tmp), [])
+
+  def test_saveLoad(self):
+    s = aliPublish.RemoteSnapshot(self.tmp, "http://tars", "slc7/x86_64")
+    s.setVersions("A", "mtime1", [ "1", "2" ])
+    s.save(graph())
+    self.assertEqual(listdir(self.tmp), [ "snapshot-slc7_x86_64.json" ])
+    s = aliPublish.RemoteSnapshot(self.tmp, "http://tars", "slc7/x86_64")
+    self.assertEqual(s.versions("A", "mtime1"), [ "1", "2" ])
+    g = aliPublish.PackageGraph("slc7/x86_64")
+    s.restore(g)
+    self.assertEqual(g.deps("dist-runtime", ("A", "2")), set([ ("B", "1") ]))
+    self.assertEqual(g.deps("dist-direct", ("A", "1")), set([ ("B", "1") ]))
+    self.assertEqual(g.tarballs[("A", "1")]["size"], 42)
+
+  def test_otherRemote(self):
+    s = aliPublish.RemoteSnapshot(self.tmp, "http://tars", "slc7/x86_64")
+    s.setVersions("A", "mtime1", [ "1" ])
+    s.save(graph())
+    s = aliPublish.RemoteSnapshot(self.tmp, "http://elsewhere", "slc7/x86_64")
+    self.assertIsNone(s.versions("A", "mtime1"))
+    self.assertEqual(s.deps["dist-runtime"], {})
+
+  def test_corrupted(self):
+    with open(join(self.tmp, "snapshot-slc7_x86_64.json"), "w") as f:
+      f.write(json.dumps({ "base_url": "http://tars" })[:-3])
+    s = aliPublish.RemoteSnapshot(self.tmp, "http://tars", "slc7/x86_64")
+    self.assertEqual(s.packages, {})
+
+if __name__ == '__main__':
+  unittest.main()
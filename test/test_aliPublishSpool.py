@@ -0,0 +1,91 @@
+import io, unittest
+from hashlib import sha256
+from os import listdir
+from os.path import isfile
+from shutil import rmtree
+from tempfile import mkdtemp
+from test.aliPublishModule import aliPublish
+
+CONTENTS = { "http://tars/A-1.tar.gz": "A" * 1000,
+             "http://tars/B-1.tar.gz": "B" * 10,
+             "http://mirror/B-1.tar.gz": "B" * 10 }
+CONN = { "http_ssl_verify": False, "conn_timeout_s": 1, "conn_retries": 0, "conn_dethrottle_s": 0 }
+
+class Download(aliPublish.ResumableDownload):
+  # Serves CONTENTS instead of connecting
+  connections = []
+  def _connect(self):
+    self.connections.append(self.url)
+    data = CONTENTS[self.url][self.offset:]
+    self.end = self.offset + len(data)
+    self.raw = io.BytesIO(data)
+
+def entry(url):
+  return (url, { "size": len(CONTENTS[url]), "sha256": sha256(CONTENTS[url]).hexdigest() })
+
+class TestSpool(unittest.TestCase):
+  def setUp(self):
+    self.tmp = mkdtemp()
+    self.realDownload = aliPublish.ResumableDownload
+    aliPublish.ResumableDownload = Download
+    Download.connections = []
+
+  def tearDown(self):
+    aliPublish.ResumableDownload = self.realDownload
+    rmtree(self.tmp)
+
+  def spool(self):
+    return aliPublish.Spool(self.tmp, CONN, parallel=2)
+
+  def tarballs(self):
+    return sorted(x for x in listdir(self.tmp) if not x.startswith("index"))
+
+  def test_stage(self):
+    s = self.spool()
+    paths = s.stage([ entry("http://tars/A-1.tar.gz"), entry("http://tars/B-1.tar.gz") ])
+    self.assertEqual(open(paths["http://tars/A-1.tar.gz"]).read(), CONTENTS["http://tars/A-1.tar.gz"])
+    self.assertEqual(s.downloaded, { "http://tars/A-1.tar.gz": 1000, "http://tars/B-1.tar.gz": 10 })
+    # Staged by a previous run: not downloaded again
+    s = self.spool()
+    again = s.stage([ ("http://tars/A-1.tar.gz", {}) ])
+    self.assertEqual(again["http://tars/A-1.tar.gz"], paths["http://tars/A-1.tar.gz"])
+    self.assertEqual((len(Download.connections), s.downloaded), (2, {}))
+
+  def test_failed(self):
+    s = self.spool()
+    url,tarball = entry("http://tars/A-1.tar.gz")
+    tarball["size"] = 999
+    self.assertEqual(s.stage([ (url, tarball) ]), { url: None })
+    self.assertEqual(self.tarballs(), [])
+
+  def test_refcount(self):
+    s = self.spool()
+    path = s.stage([ entry("http://tars/A-1.tar.gz") ])["http://tars/A-1.tar.gz"]
+    s.stage([ entry("http://tars/A-1.tar.gz") ])
+    s.release("http://tars/A-1.tar.gz")
+    self.assertTrue(isfile(path))
+    s.release("http://tars/A-1.tar.gz")
+    self.assertFalse(isfile(path))
+
+  def test_sameContent(self):
+    s = self.spool()
+    paths = s.stage([ entry("http://tars/B-1.tar.gz"), entry("http://mirror/B-1.tar.gz") ])
+    self.assertEqual(paths["http://tars/B-1.tar.gz"], paths["http://mirror/B-1.tar.gz"])
+    s.release("http://tars/B-1.tar.gz")
+    self.assertTrue(isfile(paths["http://mirror/B-1.tar.gz"]))
+    s.release("http://mirror/B-1.tar.gz")
+    self.assertEqual(self.tarballs(), [])
+
+  def test_holdFlush(self):
+    s = self.spool()
+    paths = s.stage([ entry("http://tars/A-1.tar.gz"), entry("http://tars/B-1.tar.gz") ])
+    s.hold()
+    s.release("http://tars/A-1.tar.gz")
+    self.assertTrue(isfile(paths["http://tars/A-1.tar.gz"]))
+    s.flush()
+    self.assertFalse(isfile(paths["http://tars/A-1.tar.gz"]))
+    self.assertTrue(isfile(paths["http://tars/B-1.tar.gz"]))
+    self.assertEqual(self.spool().index.keys(), [ "http://tars/B-1.tar.gz" ])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,120 @@
+import io, os, tarfile, unittest
+from distutils.spawn import find_executable
+from os.path import join
+from shutil import rmtree
+from subprocess import check_call
+from tempfile import mkdtemp
+from test.aliPublishModule import aliPublish
+
+def tarball(path, base):
+  # Laid out like the packages built by aliBuild: ./<arch>/<package>/<version>/...
+  with tarfile.open(path, "w:gz") as tar:
+    for name in [ ".", base, base + "bin" ]:
+      info = tarfile.TarInfo(name)
+      info.type = tarfile.DIRTYPE
+      info.mode = 0755
+      tar.addfile(info)
+    for name,data,mode in [ ("bin/tool", "tool", 0755), ("etc/modulefiles/pkg", "#%Module\n", 0644) ]:
+      info = tarfile.TarInfo(base + name)
+      info.size = len(data)
+      info.mode = mode
+      tar.addfile(info, io.BytesIO(data))
+    link = tarfile.TarInfo(base + "bin/tool-link")
+    link.type = tarfile.LNKTYPE
+    link.linkname = base + "bin/tool"
+    tar.addfile(link)
+
+def version(path, ver):
+  # <package>/ is listed too, like in the packages built by aliBuild
+  with tarfile.open(path, "w:gz") as tar:
+    for name,mode in [ ("./arch/pkg/", 0555), ("./arch/pkg/%s/" % ver, 0755) ]:
+      info = tarfile.TarInfo(name)
+      info.type = tarfile.DIRTYPE
+      info.mode = mode
+      tar.addfile(info)
+    info = tarfile.TarInfo("./arch/pkg/%s/bin/tool" % ver)
+    info.size = len(ver)
+    tar.addfile(info, io.BytesIO(ver))
+
+def tree(root):
+  # Relative paths with their contents (None for directories)
+  result = {}
+  for d,dirs,files in os.walk(root):
+    for name in dirs:
+      result[os.path.relpath(join(d, name), root)] = None
+    for name in files:
+      result[os.path.relpath(join(d, name), root)] = open(join(d, name)).read()
+  return result
+
+class TestUnpack(unittest.TestCase):
+  def setUp(self):
+    self.tmp = mkdtemp()
+
+  def tearDown(self):
+    rmtree(self.tmp)
+
+  def unpack(self, path, strip):
+    dest = mkdtemp(dir=self.tmp)
+    with open(path, "rb") as fp:
+      aliPublish.unpackTarball(fp, dest, strip)
+    return dest
+
+  def test_stripPath(self):
+    strip = aliPublish.stripPath
+    self.assertEqual(strip("./arch/pkg/ver/bin/tool", 2), "pkg/ver/bin/tool")
+    self.assertEqual(strip("arch/pkg/ver/bin/tool", 2), "ver/bin/tool")
+    self.assertEqual(strip("/arch//pkg/./ver/", 2), "ver")
+    self.assertIsNone(strip("./arch/", 2))
+    self.assertIsNone(strip(".", 2))
+    self.assertRaises(aliPublish.PublishException, strip, "./arch/pkg/../../../etc", 2)
+
+  @unittest.skipUnless(find_executable("tar"), "tar is not available")
+  def test_sameAsTar(self):
+    for base in [ "./arch/pkg/ver/", "arch/pkg/ver/" ]:
+      path = join(self.tmp, "pkg.tar.gz")
+      tarball(path, base)
+      expected = mkdtemp(dir=self.tmp)
+      check_call([ "tar", "-C", expected, "--strip-components=2", "-xzf", path ])
+      got = self.unpack(path, 2)
+      self.assertEqual(tree(got), tree(expected))
+      # Hard links are copies
+      tool = join(got, aliPublish.stripPath(base + "bin/tool", 2))
+      self.assertNotEqual(os.stat(tool + "-link").st_ino, os.stat(tool).st_ino)
+
+  def test_sharedDir(self):
+    # The directory of the package is left as it is, the one of the version is restored
+    path = join(self.tmp, "pkg.tar.gz")
+    version(path, "1")
+    dest = mkdtemp(dir=self.tmp)
+    os.mkdir(join(dest, "pkg"), 0750)
+    with open(path, "rb") as fp:
+      aliPublish.unpackTarball(fp, dest, 2)
+    self.assertEqual(os.stat(join(dest, "pkg")).st_mode & 0777, 0750)
+    self.assertEqual(os.stat(join(dest, "pkg", "1")).st_mode & 0777, 0755)
+
+  def test_parallel(self):
+    # Every directory is created by another unpack right before this one does it
+    path = join(self.tmp, "pkg.tar.gz")
+    version(path, "1")
+    realMkdir = aliPublish.mkdir
+    def mkdir(path, mode=0777):
+      realMkdir(path, 0755)
+      realMkdir(path, mode)
+    aliPublish.mkdir = mkdir
+    try:
+      dest = self.unpack(path, 2)
+    finally:
+      aliPublish.mkdir = realMkdir
+    self.assertEqual(open(join(dest, "pkg", "1", "bin", "tool")).read(), "1")
+
+  def test_unsafe(self):
+    path = join(self.tmp, "evil.tar.gz")
+    with tarfile.open(path, "w:gz") as tar:
+      info = tarfile.TarInfo("./arch/pkg/../../../evil")
+      info.size = 4
+      tar.addfile(info, io.BytesIO("evil"))
+    self.assertRaises(aliPublish.PublishException, self.unpack, path, 2)
+    self.assertFalse(os.path.exists(join(self.tmp, "evil")))
+
+if __name__ == '__main__':
+  unittest.main()
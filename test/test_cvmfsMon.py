@@ -0,0 +1,75 @@
+import imp, time, unittest
+from datetime import datetime
+from os.path import dirname, join, realpath
+
+# cvmfs-mon.py cannot be imported by name
+CVMFSMON = join(dirname(dirname(realpath(__file__))), "cvmfs-mon", "cvmfs-mon.py")
+cvmfsmon = imp.load_source("cvmfsmon", CVMFSMON)
+
+MONIT = { "repos": { "alice.cern.ch": { "s1": { "url": "http://s1", "contact": [ "admin" ] } } },
+          "max_revdelta": 10, "max_timedelta": 7200, "max_sync_time": 600, "history_samples": 96,
+          "trend_samples": 4, "snooze": 3600, "history_file": None, "notif": {} }
+
+class TestTrend(unittest.TestCase):
+  def test_slope(self):
+    self.assertAlmostEqual(cvmfsmon.slope([ (0, 1), (10, 3), (20, 5) ]), 0.2)
+    self.assertAlmostEqual(cvmfsmon.slope([ (0, 4), (10, 2), (20, 1), (30, -2) ]), -0.19)
+    # Flat, or all samples at the same time
+    self.assertEqual(cvmfsmon.slope([ (0, 7), (10, 7) ]), 0.)
+    self.assertEqual(cvmfsmon.slope([ (5, 1), (5, 2) ]), 0.)
+
+  def test_trend(self):
+    # Stratum 0 publishes one revision every 10 seconds, stratum 1 two: the lag shrinks by one
+    # revision every 10 seconds
+    samples = [ [ t, 100+t/10, 80+t/5 ] for t in range(0, 40, 10) ]
+    throughput,closing,eta = cvmfsmon.trend(samples, 4)
+    self.assertAlmostEqual(throughput, 0.2)
+    self.assertAlmostEqual(closing, 0.1)
+    self.assertAlmostEqual(eta, 170)
+    # Stratum 1 stuck
+    throughput,closing,eta = cvmfsmon.trend([ [ t, 100+t/10, 80 ] for t in range(0, 40, 10) ], 4)
+    self.assertEqual((throughput, eta), (0, None))
+    self.assertTrue(closing < 0)
+
+  def test_notEnough(self):
+    samples = [ [ t, 100, 90 ] for t in range(0, 40, 10) ]
+    self.assertIsNone(cvmfsmon.trend(samples[:3], 4))
+    self.assertIsNone(cvmfsmon.trend(samples, 1))
+    # In sync at some point: not lagging since then
+    samples[1][2] = 100
+    self.assertIsNone(cvmfsmon.trend(samples, 4))
+
+class TestCheck(unittest.TestCase):
+  def setUp(self):
+    self.realFetchAll = cvmfsmon.fetch_all
+    self.realNotify = cvmfsmon.notify
+    self.notified = []
+    cvmfsmon.notify = lambda notif, to, **keys: self.notified.append(keys)
+
+  def tearDown(self):
+    cvmfsmon.fetch_all = self.realFetchAll
+    cvmfsmon.notify = self.realNotify
+
+  def check(self, history, s0, s1):
+    now = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S")
+    cvmfsmon.fetch_all = lambda monit, strata: [ ("alice.cern.ch", "s1", {
+      "s0_rev": s0, "s1_rev": s1, "s0_mod": now, "s1_mod": now, "ok": True }, None) ]
+    monit = dict(MONIT, repos={ "alice.cern.ch": { "s1": dict(MONIT["repos"]["alice.cern.ch"]["s1"]) } })
+    cvmfsmon.check(monit, history)
+
+  def test_keepingUp(self):
+    # A busy stratum 0, and a stratum 1 always two revisions behind
+    t0 = time.time()-40
+    history = { "alice.cern.ch:s1": [ [ t0+10*i, 100+i, 98+i ] for i in range(4) ] }
+    self.check(history, 104, 102)
+    self.assertEqual(self.notified, [])
+
+  def test_notShrinking(self):
+    t0 = time.time()-40
+    history = { "alice.cern.ch:s1": [ [ t0+10*i, 100+i, 80 ] for i in range(4) ] }
+    self.check(history, 104, 80)
+    self.assertEqual(len(self.notified), 1)
+    self.assertTrue("lag not shrinking" in self.notified[0]["trend"])
+
+if __name__ == '__main__':
+  unittest.main()
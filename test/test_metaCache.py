@@ -0,0 +1,94 @@
+import unittest
+from os.path import dirname, join, realpath
+from sys import path
+path.insert(0, join(dirname(dirname(realpath(__file__))), "ci"))
+import metagit
+from metagit import MetaCache
+
+class Obj(object):
+  def __init__(self, name, changed=False):
+    self.name = name
+    self.changed = changed
+    self.updates = 0
+  def update(self):
+    self.updates += 1
+    return self.changed
+
+class TestMetaCache(unittest.TestCase):
+  def setUp(self):
+    self.now = 1000.
+    self.realTime = metagit.time
+    metagit.time = lambda: self.now
+
+  def tearDown(self):
+    metagit.time = self.realTime
+
+  def test_missThenHit(self):
+    c = MetaCache("test", maxsize=10, ttl=60)
+    a = Obj("a")
+    self.assertIs(c.get("a", lambda: a), a)
+    self.assertIs(c.get("a", lambda: self.fail("fetched twice")), a)
+    self.assertEqual((c.misses, c.hits, c.revalidated), (1, 1, 0))
+
+  def test_lru(self):
+    c = MetaCache("test", maxsize=2, ttl=60)
+    c.get("a", lambda: Obj("a"))
+    c.get("b", lambda: Obj("b"))
+    c.get("a", lambda: Obj("a"))  # a is now the most recently used
+    c.get("c", lambda: Obj("c"))
+    self.assertTrue("a" in c)
+    self.assertFalse("b" in c)
+    self.assertTrue("c" in c)
+    self.assertEqual((len(c), c.evicted), (2, 1))
+    c.put("d", Obj("d"))
+    self.assertFalse("a" in c)
+    self.assertEqual(c.evicted, 2)
+
+  def test_revalidation(self):
+    c = MetaCache("test", maxsize=10, ttl=60)
+    a = Obj("a")
+    c.get("a", lambda: a)
+    self.now += 59
+    c.get("a", lambda: a)
+    self.assertEqual(a.updates, 0)
+    self.now += 1
+    self.assertIs(c.get("a", lambda: self.fail("fetched twice")), a)
+    self.assertEqual((a.updates, c.revalidated, c.hits, c.misses), (1, 1, 2, 1))
+    # Revalidated now: not again until ttl expires
+    c.get("a", lambda: a)
+    self.assertEqual(a.updates, 1)
+    # Changed objects count as misses
+    a.changed = True
+    self.now += 60
+    c.get("a", lambda: a)
+    self.assertEqual((a.updates, c.revalidated, c.misses), (2, 2, 2))
+
+  def test_maxage(self):
+    c = MetaCache("test", maxsize=10, ttl=60)
+    a = Obj("a")
+    c.get("a", lambda: a)
+    c.get("a", lambda: a, maxage=0)
+    self.assertEqual(a.updates, 1)
+
+  def test_immutable(self):
+    c = MetaCache("test", maxsize=10, ttl=None)
+    a = Obj("a")
+    c.get("a", lambda: a)
+    self.now += 86400
+    c.get("a", lambda: a)
+    self.assertEqual((a.updates, c.revalidated, c.hits), (0, 0, 1))
+
+  def test_peekPutEvict(self):
+    c = MetaCache("test", maxsize=10, ttl=60)
+    self.assertIsNone(c.peek("a"))
+    a = Obj("a")
+    c.put("a", a)
+    self.assertIs(c.peek("a"), a)
+    self.assertEqual((c.hits, c.misses), (0, 0))
+    self.assertEqual(c.items(), [ ("a", a) ])
+    c.evict("a")
+    c.evict("a")
+    self.assertEqual((len(c), c.evicted), (0, 1))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,92 @@
+import unittest
+from datetime import datetime
+from os.path import dirname, join, realpath
+from shutil import rmtree
+from sys import path
+from tempfile import mkdtemp
+path.insert(0, join(dirname(dirname(realpath(__file__))), "ci"))
+from metagit import MetaGit_Cassette, MetaGitException, MetaPull, MetaStatus, MetaComment
+
+class Backend(object):
+  # Stands for the recorded backend: results change at every call
+  def __init__(self):
+    self.calls = 0
+  def get_pull(self, pr, cached=False):
+    self.calls += 1
+    return MetaPull(name=pr, repo="a/b", num=1, title="title %d" % self.calls, changed_files=2,
+                    sha="abc", closed_at=None, mergeable=True, mergeable_state="clean",
+                    who="someone", when=datetime(2018, 1, 1), get_files=lambda: iter(["x", "y"]))
+  def get_pulls(self, repo):
+    return set([ repo + "#1", repo + "#2" ])
+  def get_statuses(self, pr, contexts=None):
+    self.calls += 1
+    return { "build": MetaStatus(context="build", state="pending", description="%d" % self.calls) }
+  def get_comments(self, pr):
+    yield MetaComment(body="hello\nworld", short="hello", who="someone", when=datetime(2018, 1, 1))
+  def merge(self, pr):
+    raise MetaGitException("cannot merge %s" % pr)
+
+class TestCassette(unittest.TestCase):
+  def setUp(self):
+    self.tmp = mkdtemp()
+    self.path = join(self.tmp, "cassette.yaml")
+
+  def tearDown(self):
+    rmtree(self.tmp)
+
+  def record(self, calls):
+    rec = MetaGit_Cassette(cassette=self.path, mode="record", wrapped="GitHub", token="none")
+    rec.backend = Backend()
+    calls(rec)
+    rec.save()
+    rec.mode = "saved"  # the file is gone when the saving registered at exit runs
+    return MetaGit_Cassette(cassette=self.path, mode="replay")
+
+  def test_key(self):
+    key = MetaGit_Cassette._key
+    self.assertEqual(key("get_statuses", [ "a/b#1", [ "b", "a" ] ], {}),
+                     key("get_statuses", [ "a/b#1", [ "a", "b" ] ], {}))
+    self.assertEqual(key("get_pull", [ "a/b#1" ], { "cached": True }),
+                     key("get_pull", [ "a/b#1" ], {}))
+    self.assertNotEqual(key("get_pull", [ "a/b#1" ], {}), key("get_pull", [ "a/b#2" ], {}))
+    self.assertNotEqual(key("set_status", [ "a/b#1", "build", "success" ], { "force": True }),
+                        key("set_status", [ "a/b#1", "build", "success" ], { "force": False }))
+
+  def test_replayInOrder(self):
+    def calls(git):
+      git.get_statuses("a/b#1", [ "build", "test" ])
+      git.get_statuses("a/b#1", [ "test", "build" ])
+    play = self.record(calls)
+    self.assertEqual(play.get_statuses("a/b#1", [ "build", "test" ])["build"].description, "1")
+    self.assertEqual(play.get_statuses("a/b#1", [ "build", "test" ])["build"].description, "2")
+    # The last result is repeated
+    self.assertEqual(play.get_statuses("a/b#1", [ "build", "test" ])["build"].description, "2")
+    with self.assertRaises(MetaGitException):
+      play.get_statuses("a/b#1", [ "build" ])
+    self.assertEqual((play.replayed, play.missing), (3, 1))
+
+  def test_types(self):
+    def calls(git):
+      pull = git.get_pull("a/b#1")
+      self.assertEqual(list(pull.get_files()), [ "x", "y" ])
+      git.get_pulls("a/b")
+      self.assertEqual(len(list(git.get_comments("a/b#1"))), 1)
+      with self.assertRaises(MetaGitException):
+        git.merge("a/b#1")
+    play = self.record(calls)
+    pull = play.get_pull("a/b#1", cached=True)
+    self.assertEqual((pull.title, pull.when, pull.mergeable_state),
+                     ("title 1", datetime(2018, 1, 1), "clean"))
+    self.assertEqual(list(pull.get_files()), [ "x", "y" ])
+    self.assertEqual(play.get_pulls("a/b"), set([ "a/b#1", "a/b#2" ]))
+    self.assertEqual([ c.short for c in play.get_comments("a/b#1") ], [ "hello" ])
+    with self.assertRaises(MetaGitException):
+      play.merge("a/b#1")
+
+  def test_filesNotRecorded(self):
+    play = self.record(lambda git: git.get_pull("a/b#1"))
+    with self.assertRaises(MetaGitException):
+      play.get_pull("a/b#1").get_files()
+
+if __name__ == '__main__':
+  unittest.main()
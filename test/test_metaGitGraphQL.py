@@ -0,0 +1,54 @@
+import unittest
+from os.path import dirname, join, realpath
+from sys import path
+path.insert(0, join(dirname(dirname(realpath(__file__))), "ci"))
+from metagit import MetaGit_GraphQL, GraphQLPull
+
+def node(merge_state, contexts):
+  conn = lambda nodes: { "pageInfo": { "hasNextPage": False, "endCursor": None }, "nodes": nodes }
+  return { "title": "title", "changedFiles": 1, "closedAt": None, "mergeable": "MERGEABLE",
+           "mergeStateStatus": merge_state, "author": { "login": "someone" },
+           "files": conn([ { "path": "x" } ]), "comments": conn([]),
+           "commits": { "nodes": [ { "commit": { "oid": "abc", "committedDate": "2018-01-01T00:00:00Z",
+                                                 "status": { "contexts": contexts } } } ] } }
+
+class TestGraphQL(unittest.TestCase):
+  def setUp(self):
+    self.git = MetaGit_GraphQL(token="none")
+    self.contexts = []
+    self.queries = 0
+    self.posted = []
+    def query(body):
+      self.queries += 1
+      return { "pr0": { "pullRequest": node("CLEAN", list(self.contexts)) } }
+    self.git._query = query
+    self.git._rest = lambda method, path, payload: self.posted.append(payload)
+
+  def test_mergeState(self):
+    for state,expected in [ ("BLOCKED", "blocked"), ("BEHIND", "behind"), ("UNSTABLE", "unstable"),
+                            ("DIRTY", "dirty"), ("CLEAN", "clean"), (None, "unknown") ]:
+      p = GraphQLPull("a/b#1", node(state, []), None)
+      self.assertEqual(p.pull.mergeable_state, expected)
+
+  def test_alreadySet(self):
+    self.contexts = [ { "context": "build", "state": "SUCCESS", "description": "ok" } ]
+    self.git.get_pull("a/b#1")
+    self.git.set_status("a/b#1", "build", "success", "ok")
+    self.assertEqual((self.posted, self.queries), ([], 2))
+
+  def test_outdated(self):
+    # Read as set, then changed by someone else
+    self.contexts = [ { "context": "build", "state": "SUCCESS", "description": "ok" } ]
+    self.git.get_pull("a/b#1")
+    self.contexts = [ { "context": "build", "state": "ERROR", "description": "failed" } ]
+    self.git.set_status("a/b#1", "build", "success", "ok")
+    self.assertEqual([ p["state"] for p in self.posted ], [ "success" ])
+    self.assertEqual(self.git.get_statuses("a/b#1")["build"].state, "success")
+
+  def test_notSet(self):
+    self.git.get_pull("a/b#1")
+    self.git.set_status("a/b#1", "build", "pending", "building")
+    self.assertEqual((len(self.posted), self.queries), (1, 1))
+
+if __name__ == '__main__':
+  unittest.main()
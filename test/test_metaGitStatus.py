@@ -0,0 +1,67 @@
+import unittest
+from os.path import dirname, join, realpath
+from sys import path
+path.insert(0, join(dirname(dirname(realpath(__file__))), "ci"))
+from metagit import MetaGit_GitHub, MetaStatus
+
+class Status(object):
+  def __init__(self, context, state, description):
+    self.context = context
+    self.state = state
+    self.description = description
+
+class Commit(object):
+  # Stands for a PyGithub commit: statuses are newest first
+  def __init__(self, sha):
+    self.sha = sha
+    self.statuses = []
+    self.reads = 0
+  def get_statuses(self):
+    self.reads += 1
+    return list(self.statuses)
+  def create_status(self, state, description, context):
+    self.statuses.insert(0, Status(context, state, description))
+
+class TestSetStatus(unittest.TestCase):
+  def setUp(self):
+    self.git = MetaGit_GitHub(token="none")
+    self.commit = Commit("abc")
+    self.git.get_rate_limit = lambda: (0, 0, 0)
+    self.git._pull = lambda pr, cached=True: None
+    self.git._commit = lambda pr, ghpr: self.commit
+
+  def test_alreadySet(self):
+    self.commit.create_status("success", "ok", "build")
+    self.git.set_status("a/b#1", "build", "success", "ok")
+    self.assertEqual((len(self.commit.statuses), self.commit.reads), (1, 1))
+
+  def test_memoDiffersSkipsRead(self):
+    self.git.status_memo = { "abc": {} }
+    self.git.set_status("a/b#1", "build", "pending", "building")
+    self.assertEqual((len(self.commit.statuses), self.commit.reads), (1, 0))
+    self.assertEqual(self.git.status_memo["abc"]["build"],
+                     MetaStatus(context="build", state="pending", description="building"))
+
+  def test_outdatedMemo(self):
+    # The memo says the status is set, but it was changed by someone else since
+    self.git.status_memo = { "abc": { "build": MetaStatus(context="build", state="success",
+                                                          description="ok") } }
+    self.commit.create_status("error", "failed", "build")
+    self.git.set_status("a/b#1", "build", "success", "ok")
+    self.assertEqual(self.commit.reads, 1)
+    self.assertEqual(self.commit.statuses[0].state, "success")
+
+  def test_memoUpToDate(self):
+    self.commit.create_status("success", "ok", "build")
+    self.git.status_memo = { "abc": { "build": MetaStatus(context="build", state="success",
+                                                          description="ok") } }
+    self.git.set_status("a/b#1", "build", "success", "ok")
+    self.assertEqual((len(self.commit.statuses), self.commit.reads), (1, 1))
+
+  def test_force(self):
+    self.commit.create_status("success", "ok", "build")
+    self.git.set_status("a/b#1", "build", "success", "ok", force=True)
+    self.assertEqual((len(self.commit.statuses), self.commit.reads), (2, 0))
+
+if __name__ == '__main__':
+  unittest.main()